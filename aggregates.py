@@ -0,0 +1,94 @@
+# aggregates.py
+"""Materialized inventory analytics for the catalogue page.
+
+InventoryAggregates is a catalogue store listener: reset() computes the
+totals once from the full record list, and apply(old, new) subtracts the
+old record's contribution and adds the new one, so add/edit/stock
+updates/deletes/imports cost O(1) each and reading the analytics panel never
+walks the catalogue. The low-stock and out-of-stock parts are kept as sets
+keyed by part, listed in store order.
+"""
+
+import threading
+
+LOW_STOCK_LIMIT = 5
+
+
+class InventoryAggregates:
+    """Running totals, per-category stats and stock alert sets for a catalogue."""
+
+    def __init__(self, key_of, low_stock_limit=LOW_STOCK_LIMIT):
+        self.key_of = key_of
+        self.low_stock_limit = low_stock_limit
+        self._lock = threading.RLock()
+        self.reset(())
+
+    def reset(self, records):
+        with self._lock:
+            self.total_parts = 0
+            self.total_stock = 0
+            self.total_value = 0
+            self.price_sum = 0
+            self._categories = {}
+            self._low = {}
+            self._out = {}
+            self._order = {}
+            self._next = 0
+            for record in records:
+                self.apply(None, record)
+
+    def _add(self, record, sign):
+        price = record.get("price", 0)
+        stock = record.get("stock", 0)
+        self.total_parts += sign
+        self.total_stock += sign * stock
+        self.total_value += sign * price * stock
+        self.price_sum += sign * price
+
+        category = record.get("category", "Other")
+        stats = self._categories.setdefault(category, {"count": 0, "total_stock": 0, "total_value": 0})
+        stats["count"] += sign
+        stats["total_stock"] += sign * stock
+        stats["total_value"] += sign * price * stock
+        if not stats["count"]:
+            del self._categories[category]
+
+        key = self.key_of(record)
+        alerts = self._out if stock == 0 else self._low if 0 < stock <= self.low_stock_limit else None
+        if alerts is not None:
+            if sign > 0:
+                alerts[key] = record
+            else:
+                alerts.pop(key, None)
+
+    def apply(self, old, new):
+        with self._lock:
+            if old is not None:
+                self._add(old, -1)
+            if new is not None:
+                key = self.key_of(new)
+                if key not in self._order:
+                    self._order[key] = self._next
+                    self._next += 1
+                self._add(new, +1)
+            elif old is not None:
+                self._order.pop(self.key_of(old), None)
+
+    def _in_order(self, parts):
+        return [parts[k] for k in sorted(parts, key=self._order.__getitem__)]
+
+    def summary(self):
+        """The catalogue analytics panel values, as the template expects them."""
+        with self._lock:
+            return {
+                "total_parts": self.total_parts,
+                "total_stock": self.total_stock,
+                "total_value": round(self.total_value, 6),
+                "avg_price": round(self.price_sum, 6) / max(self.total_parts, 1),
+                "low_stock_parts": self._in_order(self._low),
+                "out_of_stock_parts": self._in_order(self._out),
+                "category_stats": {
+                    cat: dict(stats, total_value=round(stats["total_value"], 6))
+                    for cat, stats in self._categories.items()
+                },
+            }
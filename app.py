@@ -1,21 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash, session
-import json
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash, session,
+                   stream_with_context, send_from_directory)
+import click
+import itertools
 import os
-import csv
-import re
-from io import BytesIO
-from difflib import SequenceMatcher, get_close_matches
-from werkzeug.utils import secure_filename
+import time
 from datetime import datetime
-try:
-    from openpyxl import load_workbook, Workbook
-    HAS_OPENPYXL = True
-except ImportError:
-    HAS_OPENPYXL = False
 
-from auth import auth, get_user_by_id
+from auth import auth, get_user_by_id, users_store
 from decorators import login_required, admin_required
 from models import FAQ, KnowledgeBaseArticle, SupportTicket, StatusUpdate, SupportJobCard, EscalatedJobCard
+from store import open_store, open_sequence, cache_stats, thaw, migrate_json_to_sqlite
+from search_index import NgramIndex, FuzzyIndex
+from query_cache import QueryCache
+from aggregates import InventoryAggregates
+from sort_index import SortIndex, KeysetIndex, natural_number
+from recommender import CoPurchaseIndex
+from import_jobs import start_import_job, read_job
+from carts import CartStore
+from checkout import StockReservations, StockError, place_order, repair_checkouts
+from order_archive import SegmentArchive, archivable
+from image_uploads import (save_image_upload, store_image_stream, image_set, is_fingerprinted,
+                           orphaned_uploads)
+from export_cache import ExportCache
+from exports import (csv_chunks, gzip_chunks, wants_gzip, Export, export_response,
+                     EXPORT_FORMATS, HAS_OPENPYXL)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-in-production'
@@ -27,79 +35,179 @@ app.register_blueprint(auth)
 UPLOAD_FOLDER = os.path.join('static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+UPLOAD_CACHE_MAX_AGE = int(os.environ.get("UPLOAD_CACHE_MAX_AGE", 365 * 24 * 3600))
 
 # Create uploads folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Filtered/sorted listings keyed by route, query and store version
+query_cache = QueryCache("listings")
+
+# Generated job card and rewards export files, reused while the data is unchanged
+export_cache = ExportCache()
+
 @app.context_processor
 def inject_cart_count():
     """Make cart item count available in all templates for the navbar badge"""
-    cart = load_cart() if os.path.exists(CART_FILE) else []
-    return dict(global_cart_count=sum(item.get("quantity", 0) for item in cart))
+    if "user_id" not in session:
+        return dict(global_cart_count=0)
+    return dict(global_cart_count=carts.count(cart_owner(), session.get("cart_version", 0)))
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.template_global()
+def part_images(url):
+    """Thumbnail, WebP and full-size URLs for a catalogue image"""
+    return image_set(url, app.config['UPLOAD_FOLDER'])
+
+@app.route("/static/uploads/<path:filename>")
+def uploaded_file(filename):
+    """Serve uploads; content-addressed files are cached by browsers for good"""
+    if not is_fingerprinted(filename):
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # The name is a hash of the bytes, so it is a strong validator and the file never changes
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename,
+                                   etag=os.path.basename(filename), max_age=UPLOAD_CACHE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+def save_part_image(file):
+    """Store an uploaded part image and return its URL, or None if it was rejected"""
+    if not (file and file.filename and allowed_file(file.filename)):
+        return None
+    try:
+        return save_image_upload(file, app.config['UPLOAD_FOLDER'])
+    except ValueError as e:
+        flash(f"Image not saved: {e}.", "error")
+    except OSError as e:
+        print(f"Error saving file: {e}")
+    return None
+
 # Job Cards Storage
 DATA_FILE = "jobs_data.json"
 
-def load_jobs():
-    """Load jobs from JSON file"""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
+def default_jobs():
+    """Sample job cards used when no jobs file exists yet"""
     return [
         {"license_plate": "SGX1234A", "status": "Open",   "remarks": "Initial review", "assigned_to": "Alice", "problem": "", "parts_used": []},
         {"license_plate": "SGX5678B", "status": "Closed", "remarks": "Completed",      "assigned_to": "Bob", "problem": "", "parts_used": []},
     ]
 
+jobs_store = open_store("jobs", DATA_FILE, key="license_plate", default=default_jobs)
+
+def load_jobs():
+    """Load jobs from JSON file"""
+    return jobs_store.load()
+
 def save_jobs(jobs):
     """Save jobs to JSON file"""
-    with open(DATA_FILE, "w") as f:
-        json.dump(jobs, f, indent=2)
-
-jobs = load_jobs()
+    jobs_store.save(jobs)
 
 # Orders Storage
 ORDERS_FILE = "orders_data.json"
-CART_FILE = "cart_data.json"
+
+orders_store = open_store("orders", ORDERS_FILE, key="order_id")
+
+def first_order_number():
+    """Number after the highest existing ORD id, archived ones included, used once to seed the order id sequence"""
+    numbers = [int(o["order_id"][3:]) for o in itertools.chain(orders_store.snapshot(), order_archive.records())
+               if o.get("order_id", "").startswith("ORD") and o["order_id"][3:].isdigit()]
+    return max(numbers, default=1000) + 1
+
+# Finished orders moved out of the store by `flask archive-orders` (see order_archive.py)
+order_archive = SegmentArchive(key_of=orders_store.key_of, date_of=lambda o: o.get("date") or "")
+
+order_numbers = open_sequence("order_id", "order_id.seq.json", start=first_order_number)
+
+# Orders newest first, overall and per status / delivery option / customer account, for paging
+ORDERS_PAGE_SIZE = int(os.environ.get("ORDERS_PAGE_SIZE", 25))
+ORDERS_MAX_PAGE_SIZE = int(os.environ.get("ORDERS_MAX_PAGE_SIZE", 200))
+ORDER_FILTERS = ("status", "delivery_option", "placed_by")
+
+# Also partitioned by delivery_status for the deliveries board
+orders_index = KeysetIndex(orders_store.key_of, lambda o: o.get("date") or "",
+                           {name: name for name in ORDER_FILTERS + ("delivery_status",)})
+orders_store.add_listener(orders_index)
+
+def order_matches(search_query, filters):
+    """Predicate for orders matching a lowercased search and status/delivery_option/placed_by filters"""
+    filters = {name: value for name, value in filters.items() if value}
+    def matches(o):
+        if any(o.get(name) != value for name, value in filters.items()):
+            return False
+        return (not search_query
+                or search_query in o.get("order_id", "").lower()
+                or search_query in o.get("customer_name", "").lower()
+                or search_query in o.get("status", "").lower())
+    return matches
+
+def parse_order_cursor(value):
+    """(date, order_id) from an after/before query value, or None"""
+    date, sep, order_id = (value or "").rpartition("|")
+    return (date, order_id) if sep and order_id else None
+
+def order_cursor(order):
+    return "|".join(orders_index.cursor(order))
+
+# Each user's cart, in memory (see carts.py)
+carts = CartStore()
 
 def load_orders():
     """Load orders from JSON file"""
-    if os.path.exists(ORDERS_FILE):
-        with open(ORDERS_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+    return orders_store.load()
 
 def save_orders(orders):
     """Save orders to JSON file"""
-    with open(ORDERS_FILE, "w") as f:
-        json.dump(orders, f, indent=2)
+    orders_store.save(orders)
+
+def cart_owner():
+    """Cart key for the logged-in user"""
+    return str(session.get("user_id", ""))
 
 def load_cart():
-    """Load shopping cart from JSON file"""
-    if os.path.exists(CART_FILE):
-        with open(CART_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+    """Items in the logged-in user's cart"""
+    return carts.items(cart_owner(), session.get("cart_version", 0))
 
-def save_cart(cart):
-    """Save shopping cart to JSON file"""
-    with open(CART_FILE, "w") as f:
-        json.dump(cart, f, indent=2)
+def cart_part(item_name):
+    """Catalogue part a cart line refers to, matched by name, or None for free-text items"""
+    parts = catalogue_store.find("name", item_name)
+    return parts[0] if parts else None
+
+def parse_quantity(value):
+    """A form quantity as an int of at least 1, or None"""
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return None
+    return quantity if quantity >= 1 else None
+
+def add_to_cart(item_name, price, quantity, part=None):
+    """Add an item to the logged-in user's cart, reserving catalogue stock for it"""
+    if parse_quantity(quantity) is None:
+        flash("Quantity must be a whole number of at least 1.", "error")
+        return False
+    owner = cart_owner()
+    if part is not None:
+        in_cart = sum(i["quantity"] for i in load_cart() if i["item_name"] == item_name)
+        try:
+            reservations.reserve(owner, part, in_cart + quantity)
+        except StockError as e:
+            name, wanted, available = e.shortages[0]
+            flash(f"Only {available} x {name} available, {in_cart} already in your cart.", "error")
+            return False
+    session["cart_version"] = carts.add(owner, item_name, price, quantity, session.get("cart_version", 0),
+                                        part_id=part["part_id"] if part is not None else None)
+    return True
 
 # Rewards Storage
 REWARDS_FILE = "rewards_data.json"
 
+rewards_store = open_store("rewards", REWARDS_FILE, key=("phone_number", "license_plate"))
+
 def load_rewards():
     """
     Stored format (list of dicts):
@@ -107,17 +215,10 @@ def load_rewards():
       {"customer_id": "S1234567A", "name": "Alice Tan", "purchases": 2, "redeemed": 0}
     ]
     """
-    if os.path.exists(REWARDS_FILE):
-        with open(REWARDS_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+    return rewards_store.load()
 
 def save_rewards(customers):
-    with open(REWARDS_FILE, "w") as f:
-        json.dump(customers, f, indent=2)
+    rewards_store.save(customers)
 
 def compute_reward_balance(customer):
     """
@@ -132,40 +233,89 @@ def compute_reward_balance(customer):
 # Catalogue Storage
 CATALOGUE_FILE = "catalogue_data.json"
 
+catalogue_store = open_store("catalogue", CATALOGUE_FILE, key="part_id", indexes={"name": "name", "category": "category"})
+
+# Short-lived holds on catalogue stock for parts sitting in carts (see checkout.py)
+RESERVATIONS_FILE = "reservations_data.json"
+# Written straight through: other workers must see a hold as soon as its lock is released
+reservations_store = open_store("reservations", RESERVATIONS_FILE, key=("owner", "part_id"),
+                                indexes={"part_id": "part_id"}, durability="sync")
+reservations = StockReservations(reservations_store, catalogue_store)
+
+# Checkouts between their stock and order writes, for repair_checkouts() (file engines only)
+CHECKOUTS_FILE = "checkouts_data.json"
+checkout_log = open_store("checkouts", CHECKOUTS_FILE, key="order_id", durability="sync")
+
+# Substring search index over the searchable part fields, kept in sync on every catalogue write
+catalogue_search = NgramIndex(
+    "catalogue", ("part_id", "name", "category", "description"), catalogue_store.key_of,
+    path=os.path.splitext(CATALOGUE_FILE)[0] + ".ngrams.json",
+)
+catalogue_store.add_listener(catalogue_search)
+
+# Trigram similarity index behind the "Did you mean?" fallback
+catalogue_fuzzy = FuzzyIndex(
+    "catalogue", ("name", "category", "description"), catalogue_store.key_of,
+    suggest_fields=("name", "category"),
+)
+catalogue_store.add_listener(catalogue_fuzzy)
+
+# Inventory analytics panel totals, updated by delta on each write
+catalogue_analytics = InventoryAggregates(catalogue_store.key_of)
+catalogue_store.add_listener(catalogue_analytics)
+
+# Every catalogue sort order kept pre-sorted; the natural part number is parsed once per write
+catalogue_sorts = SortIndex(catalogue_store.key_of, {
+    "price": lambda p: p.get("price", 0),
+    "name": lambda p: p.get("name", "").lower(),
+    "stock": lambda p: p.get("stock", 0),
+    "part_number": lambda p: natural_number(p.get("part_id", "")),
+})
+catalogue_store.add_listener(catalogue_sorts)
+
+# Co-purchase matrix over order items and job card parts, updated on every checkout/job edit
+co_purchases = CoPurchaseIndex()
+orders_store.add_listener(co_purchases.source(
+    "orders", orders_store.key_of, lambda o: [f"name:{item['item_name']}" for item in o.get("items", [])]))
+jobs_store.add_listener(co_purchases.source(
+    "jobs", jobs_store.key_of, lambda j: [f"id:{part_id}" for part_id in j.get("parts_used", []) if part_id]))
+
+# A worker that died mid-checkout may have left stock taken with no order
+if repair_checkouts(catalogue_store, orders_store, checkout_log):
+    print("Put back stock of checkouts interrupted before their order was saved")
+
+# sort query parameter -> (sort key, descending)
+CATALOGUE_SORTS = {
+    "price_low": ("price", False),
+    "price_high": ("price", True),
+    "name_az": ("name", False),
+    "name_za": ("name", True),
+    "stock_low": ("stock", False),
+    "stock_high": ("stock", True),
+}
+
 def load_catalogue():
     """Load catalogue items from JSON file"""
-    if os.path.exists(CATALOGUE_FILE):
-        with open(CATALOGUE_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+    return catalogue_store.load()
 
 def save_catalogue(catalogue):
     """Save catalogue items to JSON file"""
-    with open(CATALOGUE_FILE, "w") as f:
-        json.dump(catalogue, f, indent=2)
+    catalogue_store.save(catalogue)
 
 # ==================== SUPPORT FEATURES STORAGE ====================
 
 # Support Tickets Storage
 TICKETS_FILE = "support_tickets_data.json"
 
+tickets_store = open_store("tickets", TICKETS_FILE, key="ticket_id")
+
 def load_support_tickets():
     """Load support tickets from JSON file"""
-    if os.path.exists(TICKETS_FILE):
-        with open(TICKETS_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+    return tickets_store.load()
 
 def save_support_tickets(tickets):
     """Save support tickets to JSON file"""
-    with open(TICKETS_FILE, "w") as f:
-        json.dump(tickets, f, indent=2)
+    tickets_store.save(tickets)
 
 # FAQs stored in memory
 faqs_data = [
@@ -202,9 +352,7 @@ def load_status():
 @app.route("/", methods=["GET", "POST"])
 @login_required
 def home():
-    global jobs
-    jobs = load_jobs()
-    catalogue = load_catalogue()
+    catalogue = catalogue_store.snapshot()
 
     search_query = request.args.get("search", "").strip().lower()
     is_admin = session.get('role') == 'admin'
@@ -223,24 +371,26 @@ def home():
         parts_used = request.form.getlist("parts_used")
 
         if license_plate and status:
-            # Prevent duplicate License Plate
-            if any(j.get("license_plate") == license_plate for j in jobs):
-                return redirect(url_for("home")) 
-            jobs.append({
-                "license_plate": license_plate,
-                "status": status,
-                "remarks": remarks,
-                "assigned_to": assigned_to,
-                "problem": problem,
-                "parts_used": parts_used,
-            })
-            save_jobs(jobs)
+            with jobs_store.lock():
+                # Prevent duplicate License Plate
+                if jobs_store.get(license_plate):
+                    return redirect(url_for("home")) 
+                jobs_store.upsert({
+                    "license_plate": license_plate,
+                    "status": status,
+                    "remarks": remarks,
+                    "assigned_to": assigned_to,
+                    "problem": problem,
+                    "parts_used": parts_used,
+                })
 
         return redirect(url_for("home"))
 
-    filtered_jobs = jobs
-    if search_query:
-        filtered_jobs = [
+    def search_jobs():
+        jobs = jobs_store.snapshot()
+        if not search_query:
+            return jobs
+        return [
             job for job in jobs
             if search_query in job.get("license_plate", "").lower()
             or search_query in job.get("status", "").lower()
@@ -249,26 +399,29 @@ def home():
             or search_query in job.get("problem", "").lower()
         ]
 
+    filtered_jobs = query_cache.cached(("home", search_query, jobs_store.version()), search_jobs)
+
     return render_template("index.html", jobs=filtered_jobs, search_query=search_query, is_admin=is_admin, catalogue=catalogue)
 
 @app.route("/update/<license_plate>", methods=["GET", "POST"])
 @admin_required
 def update(license_plate):
-    global jobs
-    jobs = load_jobs()
-    catalogue = load_catalogue()
+    catalogue = catalogue_store.snapshot()
 
-    job = next((j for j in jobs if j["license_plate"] == license_plate), None)
+    job = thaw(jobs_store.get(license_plate))
     if not job:
         return redirect(url_for("home"))
 
     if request.method == "POST":
-        job["status"] = request.form.get("status", "").strip()
-        job["remarks"] = request.form.get("remarks", "").strip()
-        job["assigned_to"] = request.form.get("assigned_to", "").strip()
-        job["problem"] = request.form.get("problem", "").strip()
-        job["parts_used"] = request.form.getlist("parts_used")
-        save_jobs(jobs)
+        with jobs_store.lock():
+            job = thaw(jobs_store.get(license_plate))
+            if job:
+                job["status"] = request.form.get("status", "").strip()
+                job["remarks"] = request.form.get("remarks", "").strip()
+                job["assigned_to"] = request.form.get("assigned_to", "").strip()
+                job["problem"] = request.form.get("problem", "").strip()
+                job["parts_used"] = request.form.getlist("parts_used")
+                jobs_store.upsert(job)
         return redirect(url_for("home"))
 
     return render_template("update.html", job=job, catalogue=catalogue)
@@ -276,16 +429,12 @@ def update(license_plate):
 @app.route("/delete/<license_plate>", methods=["POST"])
 @admin_required
 def delete(license_plate):
-    global jobs
-    jobs = load_jobs()
-    jobs = [j for j in jobs if j["license_plate"] != license_plate]
-    save_jobs(jobs)
+    jobs_store.delete(license_plate)
     return redirect(url_for("home"))
 
 @app.route("/rewards", methods=["GET", "POST"])
 @login_required
 def rewards():
-    customers = load_rewards()
     search_query = request.args.get("search", "").strip().lower()
     is_admin = session.get("role") == "admin"
     
@@ -299,21 +448,21 @@ def rewards():
             name = request.form.get("name", "").strip()
 
             if phone_number and license_plate:
-                existing = next((c for c in customers if c["phone_number"] == phone_number and c["license_plate"] == license_plate), None)
-                if not existing:
-                    customers.append({
-                        "phone_number": phone_number,
-                        "license_plate": license_plate,
-                        "name": name,
-                        "total_cost": 0.0,
-                        "vouchers_redeemed": 0
-                    })
-                else:
-                    # allow updating name if provided
-                    if name:
-                        existing["name"] = name
-
-                save_rewards(customers)
+                with rewards_store.lock():
+                    existing = thaw(rewards_store.get((phone_number, license_plate)))
+                    if not existing:
+                        rewards_store.upsert({
+                            "phone_number": phone_number,
+                            "license_plate": license_plate,
+                            "name": name,
+                            "total_cost": 0.0,
+                            "vouchers_redeemed": 0
+                        })
+                    else:
+                        # allow updating name if provided
+                        if name:
+                            existing["name"] = name
+                            rewards_store.upsert(existing)
 
             return redirect(url_for("rewards"))
 
@@ -331,34 +480,40 @@ def rewards():
             if cost_float < 0:
                 cost_float = 0.0
 
-            cust = next((c for c in customers if c["phone_number"] == phone_number and c["license_plate"] == license_plate), None)
-            if cust:
-                cust["total_cost"] = float(cust.get("total_cost", 0)) + cost_float
-                save_rewards(customers)
+            with rewards_store.lock():
+                cust = thaw(rewards_store.get((phone_number, license_plate)))
+                if cust:
+                    cust["total_cost"] = float(cust.get("total_cost", 0)) + cost_float
+                    rewards_store.upsert(cust)
 
             return redirect(url_for("rewards"))
 
-    # filter/search
-    filtered = customers
-    if search_query:
-        filtered = [
-            c for c in customers
-            if search_query in c.get("phone_number", "").lower()
-            or search_query in c.get("license_plate", "").lower()
-            or search_query in c.get("name", "").lower()
-        ]
-
-    # add computed fields for display
-    display_customers = []
-    for c in filtered:
-        c2 = dict(c)
-        c2["current_points"] = int(c.get("total_cost", 0))
-        c2["reward_balance"] = compute_reward_balance(c)
-        c2["points_to_next_voucher"] = 50 - (int(c.get("total_cost", 0)) % 50)
-        display_customers.append(c2)
-
-    # sort by most total_cost desc
-    display_customers.sort(key=lambda x: x.get("total_cost", 0), reverse=True)
+    def search_rewards():
+        # filter/search
+        customers = rewards_store.snapshot()
+        filtered = customers
+        if search_query:
+            filtered = [
+                c for c in customers
+                if search_query in c.get("phone_number", "").lower()
+                or search_query in c.get("license_plate", "").lower()
+                or search_query in c.get("name", "").lower()
+            ]
+
+        # add computed fields for display
+        display_customers = []
+        for c in filtered:
+            c2 = dict(c)
+            c2["current_points"] = int(c.get("total_cost", 0))
+            c2["reward_balance"] = compute_reward_balance(c)
+            c2["points_to_next_voucher"] = 50 - (int(c.get("total_cost", 0)) % 50)
+            display_customers.append(c2)
+
+        # sort by most total_cost desc
+        display_customers.sort(key=lambda x: x.get("total_cost", 0), reverse=True)
+        return display_customers
+
+    display_customers = query_cache.cached(("rewards", search_query, rewards_store.version()), search_rewards)
 
     return render_template(
         "rewards.html",
@@ -370,12 +525,12 @@ def rewards():
 @app.route("/rewards/redeem/<phone_number>/<license_plate>", methods=["POST"])
 @admin_required
 def redeem_reward(phone_number, license_plate):
-    customers = load_rewards()
-    cust = next((c for c in customers if c["phone_number"] == phone_number and c["license_plate"] == license_plate), None)
-    if cust:
-        if compute_reward_balance(cust) > 0:
-            cust["vouchers_redeemed"] = int(cust.get("vouchers_redeemed", 0)) + 1
-            save_rewards(customers)
+    with rewards_store.lock():
+        cust = thaw(rewards_store.get((phone_number, license_plate)))
+        if cust:
+            if compute_reward_balance(cust) > 0:
+                cust["vouchers_redeemed"] = int(cust.get("vouchers_redeemed", 0)) + 1
+                rewards_store.upsert(cust)
     return redirect(url_for("rewards"))
 
 
@@ -383,18 +538,102 @@ def redeem_reward(phone_number, license_plate):
 @admin_required
 def delete_reward(phone_number, license_plate):
     """Delete a customer from rewards"""
-    customers = load_rewards()
-    customers = [c for c in customers if not (c["phone_number"] == phone_number and c["license_plate"] == license_plate)]
-    save_rewards(customers)
+    rewards_store.delete((phone_number, license_plate))
     return redirect(url_for("rewards"))
 
 # ==================== CATALOGUE ROUTES ====================
 
+def recommend_for_cart(cart, limit=4):
+    """"You might also need" parts: bought together with the cart before, else same category, else high stock"""
+    cart_item_names = [item["item_name"] for item in cart]
+    cart_parts = [p for name in cart_item_names for p in catalogue_store.find("name", name)]
+    recommendations = []
+    seen = set(cart_item_names)
+    
+    def offer(p):
+        if p and p["name"] not in seen and p.get("stock", 0) > 0 and len(recommendations) < limit:
+            seen.add(p["name"])
+            recommendations.append(p)
+    
+    # Parts most often ordered or fitted together with what is in the cart
+    # (version() brings both basket sources up to date with other workers' writes)
+    orders_store.version()
+    jobs_store.version()
+    tokens = [f"name:{name}" for name in cart_item_names] + [f"id:{p['part_id']}" for p in cart_parts]
+    for token in co_purchases.recommend(tokens):
+        kind, value = token.split(":", 1)
+        for p in catalogue_store.find("name", value) if kind == "name" else [catalogue_store.get(value)]:
+            offer(p)
+        if len(recommendations) >= limit:
+            return recommendations
+    
+    # Then items from the same categories not already in cart
+    for category in dict.fromkeys(p.get("category", "") for p in cart_parts):
+        for p in catalogue_store.find("category", category):
+            offer(p)
+    
+    # If no cart-based recommendations, suggest popular/high-stock items
+    if not recommendations:
+        for p in catalogue_sorts.ordered(catalogue_store.snapshot(), "stock", reverse=True):
+            offer(p)
+            if len(recommendations) >= limit:
+                break
+    return recommendations
+
+def search_catalogue(search_query, category_filter, sort_by):
+    """Parts matching the catalogue filters in display order, plus "Did you mean?" suggestions"""
+    # Filter catalogue
+    filtered_catalogue = catalogue_store.snapshot()
+    
+    if category_filter:
+        filtered_catalogue = catalogue_store.find("category", category_filter)
+    
+    # ========== AI SMART SEARCH with Fuzzy Matching ==========
+    search_suggestions = []
+    fuzzy_ranked = False
+    
+    if search_query:
+        # Exact substring match first, answered from the n-gram index
+        exact_matches = catalogue_search.search(search_query)
+        if category_filter:
+            exact_matches = [p for p in exact_matches if p.get("category") == category_filter]
+        
+        if exact_matches:
+            filtered_catalogue = exact_matches
+        else:
+            # Fuzzy matching - find similar items when exact search fails
+            in_category = (lambda p: p.get("category") == category_filter) if category_filter else None
+            
+            # Get close matches for the search query
+            close_names = catalogue_fuzzy.suggest(search_query, "name", n=5, cutoff=0.4, accept=in_category)
+            close_cats = catalogue_fuzzy.suggest(search_query, "category", n=3, cutoff=0.4, accept=in_category)
+            
+            # Character-level similarity, ranked by relevance
+            fuzzy_matches = catalogue_fuzzy.search(search_query, accept=in_category, cutoff=0.35)
+            
+            if fuzzy_matches:
+                filtered_catalogue = [m[0] for m in fuzzy_matches]
+                fuzzy_ranked = True
+                # Generate "Did you mean?" suggestions
+                search_suggestions = list(set(close_names + close_cats))[:5]
+            else:
+                filtered_catalogue = []
+                search_suggestions = list(set(close_names + close_cats))[:5]
+    
+    # ========== SORT OPTIONS ==========
+    # Default: Sort by part_id (natural sort)
+    sort_key, descending = CATALOGUE_SORTS.get(sort_by, ("part_number", False))
+    filtered_catalogue = catalogue_sorts.ordered(
+        filtered_catalogue, sort_key, reverse=descending, store_order=not fuzzy_ranked
+    )
+    
+    return filtered_catalogue, search_suggestions
+
 @app.route("/catalogue", methods=["GET", "POST"])
 @login_required
 def catalogue():
     """Display and manage parts catalogue with images"""
-    catalogue_items = load_catalogue()
+    catalogue_items = catalogue_store.snapshot()
     search_query = request.args.get("search", "").strip().lower()
     category_filter = request.args.get("category", "").strip()
     
@@ -411,20 +650,7 @@ def catalogue():
             description = request.form.get("description", "").strip()
             
             # Handle image upload
-            image_path = None
-            if 'image' in request.files:
-                file = request.files['image']
-                if file and file.filename and allowed_file(file.filename):
-                    # Use part_id if available, otherwise use timestamp
-                    prefix = part_id if part_id else str(int(__import__('time').time()))
-                    filename = secure_filename(f"{prefix}_{file.filename}")
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    try:
-                        file.save(filepath)
-                        image_path = f"/static/uploads/{filename}"
-                    except Exception as e:
-                        print(f"Error saving file: {e}")
-                        image_path = None
+            image_path = save_part_image(request.files.get('image'))
             
             # Validate required fields
             if part_id and name and category:
@@ -445,16 +671,16 @@ def catalogue():
                     "image": image_path
                 }
                 
-                # Check if part already exists
-                existing = next((p for p in catalogue_items if p["part_id"] == part_id), None)
-                if existing:
-                    # Update existing part
-                    existing.update(new_part)
-                else:
-                    # Add new part
-                    catalogue_items.append(new_part)
-                
-                save_catalogue(catalogue_items)
+                with catalogue_store.lock():
+                    # Check if part already exists
+                    existing = thaw(catalogue_store.get(part_id))
+                    if existing:
+                        # Update existing part
+                        existing.update(new_part)
+                        catalogue_store.upsert(existing)
+                    else:
+                        # Add new part
+                        catalogue_store.upsert(new_part)
         
         # Update stock
         elif action == "update_stock":
@@ -466,166 +692,49 @@ def catalogue():
             except ValueError:
                 stock_int = 0
             
-            part = next((p for p in catalogue_items if p["part_id"] == part_id), None)
-            if part:
-                part["stock"] = stock_int
-                save_catalogue(catalogue_items)
+            with catalogue_store.lock():
+                part = thaw(catalogue_store.get(part_id))
+                if part:
+                    part["stock"] = stock_int
+                    catalogue_store.upsert(part)
         
         # Delete part
         elif action == "delete_part":
             part_id = request.form.get("part_id", "").strip()
-            catalogue_items = [p for p in catalogue_items if p["part_id"] != part_id]
-            save_catalogue(catalogue_items)
+            catalogue_store.delete(part_id)
         
         # Add to cart from catalogue
         elif action == "add_to_cart_from_catalogue":
             part_id = request.form.get("part_id", "").strip()
             quantity = request.form.get("quantity", "1").strip()
             
-            part = next((p for p in catalogue_items if p["part_id"] == part_id), None)
-            if part:
-                try:
-                    quantity_int = int(quantity)
-                except ValueError:
-                    quantity_int = 1
-                
-                cart = load_cart()
-                existing = next((item for item in cart if item["item_name"] == part["name"]), None)
-                if existing:
-                    existing["quantity"] += quantity_int
-                else:
-                    cart.append({
-                        "item_name": part["name"],
-                        "price": part["price"],
-                        "quantity": quantity_int
-                    })
-                save_cart(cart)
-                flash(f'Added {quantity_int}x {part["name"]} to cart!', 'success')
+            part = catalogue_store.get(part_id)
+            quantity_int = parse_quantity(quantity)
+            if part and quantity_int is None:
+                flash("Quantity must be a whole number of at least 1.", "error")
+            elif part:
+                if add_to_cart(part["name"], part["price"], quantity_int, part):
+                    flash(f'Added {quantity_int}x {part["name"]} to cart!', 'success')
         
         return redirect(url_for("catalogue", search=search_query, category=category_filter))
     
     # Get unique categories
     categories = sorted(set(p.get("category", "Other") for p in catalogue_items if p.get("category")))
     
-    # Filter catalogue
-    filtered_catalogue = catalogue_items
-    
-    if category_filter:
-        filtered_catalogue = [p for p in filtered_catalogue if p.get("category") == category_filter]
-    
-    # ========== AI SMART SEARCH with Fuzzy Matching ==========
-    search_suggestions = []
-    fuzzy_matches = []
-    
-    if search_query:
-        # Exact substring match first
-        exact_matches = [
-            p for p in filtered_catalogue
-            if search_query in p.get("part_id", "").lower()
-            or search_query in p.get("name", "").lower()
-            or search_query in p.get("category", "").lower()
-            or search_query in p.get("description", "").lower()
-        ]
-        
-        if exact_matches:
-            filtered_catalogue = exact_matches
-        else:
-            # Fuzzy matching - find similar items when exact search fails
-            all_names = [p.get("name", "") for p in filtered_catalogue]
-            all_categories = list(set(p.get("category", "") for p in filtered_catalogue))
-            all_searchable = all_names + all_categories
-            
-            # Get close matches for the search query
-            close_names = get_close_matches(search_query, [n.lower() for n in all_names], n=5, cutoff=0.4)
-            close_cats = get_close_matches(search_query, [c.lower() for c in all_categories], n=3, cutoff=0.4)
-            
-            # Also do character-level similarity
-            for p in filtered_catalogue:
-                name_ratio = SequenceMatcher(None, search_query, p.get("name", "").lower()).ratio()
-                cat_ratio = SequenceMatcher(None, search_query, p.get("category", "").lower()).ratio()
-                desc_ratio = SequenceMatcher(None, search_query, p.get("description", "").lower()).ratio()
-                best_ratio = max(name_ratio, cat_ratio, desc_ratio)
-                if best_ratio > 0.35:
-                    fuzzy_matches.append((p, best_ratio))
-            
-            # Sort fuzzy matches by relevance
-            fuzzy_matches.sort(key=lambda x: x[1], reverse=True)
-            
-            if fuzzy_matches:
-                filtered_catalogue = [m[0] for m in fuzzy_matches]
-                # Generate "Did you mean?" suggestions
-                search_suggestions = list(set(close_names + close_cats))[:5]
-            else:
-                filtered_catalogue = []
-                search_suggestions = list(set(close_names + close_cats))[:5]
-    
-    # ========== SORT OPTIONS ==========
+    # Filter, search and sort, reused while the catalogue is unchanged
     sort_by = request.args.get("sort", "").strip()
-    if sort_by == "price_low":
-        filtered_catalogue = sorted(filtered_catalogue, key=lambda p: p.get("price", 0))
-    elif sort_by == "price_high":
-        filtered_catalogue = sorted(filtered_catalogue, key=lambda p: p.get("price", 0), reverse=True)
-    elif sort_by == "name_az":
-        filtered_catalogue = sorted(filtered_catalogue, key=lambda p: p.get("name", "").lower())
-    elif sort_by == "name_za":
-        filtered_catalogue = sorted(filtered_catalogue, key=lambda p: p.get("name", "").lower(), reverse=True)
-    elif sort_by == "stock_low":
-        filtered_catalogue = sorted(filtered_catalogue, key=lambda p: p.get("stock", 0))
-    elif sort_by == "stock_high":
-        filtered_catalogue = sorted(filtered_catalogue, key=lambda p: p.get("stock", 0), reverse=True)
-    else:
-        # Default: Sort by part_id (natural sort)
-        def extract_number(part_id):
-            match = re.search(r'\d+', part_id)
-            return int(match.group()) if match else 0
-        filtered_catalogue = sorted(filtered_catalogue, key=lambda p: extract_number(p.get("part_id", "")))
+    key = ("catalogue", search_query, category_filter, sort_by, catalogue_store.version())
+    filtered_catalogue, search_suggestions = query_cache.cached(
+        key, lambda: search_catalogue(search_query, category_filter, sort_by)
+    )
     
     # ========== ANALYTICS DATA ==========
-    total_parts = len(catalogue_items)
-    total_stock = sum(p.get("stock", 0) for p in catalogue_items)
-    total_value = sum(p.get("price", 0) * p.get("stock", 0) for p in catalogue_items)
-    avg_price = sum(p.get("price", 0) for p in catalogue_items) / max(total_parts, 1)
-    low_stock_parts = [p for p in catalogue_items if 0 < p.get("stock", 0) <= 5]
-    out_of_stock_parts = [p for p in catalogue_items if p.get("stock", 0) == 0]
-    
-    # Category distribution for chart
-    category_stats = {}
-    for p in catalogue_items:
-        cat = p.get("category", "Other")
-        if cat not in category_stats:
-            category_stats[cat] = {"count": 0, "total_stock": 0, "total_value": 0}
-        category_stats[cat]["count"] += 1
-        category_stats[cat]["total_stock"] += p.get("stock", 0)
-        category_stats[cat]["total_value"] += p.get("price", 0) * p.get("stock", 0)
+    # Maintained by delta on every catalogue write (see aggregates.py)
+    analytics = catalogue_analytics.summary()
     
     # ========== AI RECOMMENDATIONS ==========
-    # Build category relationship map for "You might also need" suggestions
-    recommendations = []
     cart = load_cart()
-    cart_item_names = [item["item_name"] for item in cart]
-    
-    # Get categories of items in cart
-    cart_categories = set()
-    for item in cart:
-        for p in catalogue_items:
-            if p["name"] == item["item_name"]:
-                cart_categories.add(p.get("category", ""))
-    
-    # Recommend items from same categories not already in cart
-    if cart_categories:
-        for p in catalogue_items:
-            if p["name"] not in cart_item_names and p.get("category") in cart_categories and p.get("stock", 0) > 0:
-                recommendations.append(p)
-    
-    # If no cart-based recommendations, suggest popular/high-stock items
-    if not recommendations:
-        recommendations = sorted(
-            [p for p in catalogue_items if p.get("stock", 0) > 0],
-            key=lambda p: p.get("stock", 0),
-            reverse=True
-        )[:4]
-    else:
-        recommendations = recommendations[:4]
+    recommendations = recommend_for_cart(cart)
     
     # Cart count for badge
     cart_item_count = sum(item.get("quantity", 0) for item in cart)
@@ -638,56 +747,47 @@ def catalogue():
         category_filter=category_filter,
         sort_by=sort_by,
         search_suggestions=search_suggestions,
-        total_parts=total_parts,
-        total_stock=total_stock,
-        total_value=total_value,
-        avg_price=avg_price,
-        low_stock_parts=low_stock_parts,
-        out_of_stock_parts=out_of_stock_parts,
-        category_stats=category_stats,
+        import_job=request.args.get("import_job", ""),
         recommendations=recommendations,
-        cart_item_count=cart_item_count
+        cart_item_count=cart_item_count,
+        **analytics
     )
 
 @app.route("/catalogue/edit/<part_id>", methods=["GET", "POST"])
 @admin_required
 def edit_catalogue_part(part_id):
     """Edit a catalogue part"""
-    catalogue_items = load_catalogue()
-    part = next((p for p in catalogue_items if p["part_id"] == part_id), None)
+    part = thaw(catalogue_store.get(part_id))
     
     if not part:
         return redirect(url_for("catalogue"))
     
     if request.method == "POST":
-        # Update part details
-        part["name"] = request.form.get("name", "").strip()
-        part["category"] = request.form.get("category", "").strip()
-        part["description"] = request.form.get("description", "").strip()
-        
-        try:
-            part["price"] = float(request.form.get("price", "0"))
-        except ValueError:
-            part["price"] = 0.0
-        
-        try:
-            part["stock"] = int(request.form.get("stock", "0"))
-        except ValueError:
-            part["stock"] = 0
-        
         # Handle image upload
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{part_id}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                try:
-                    file.save(filepath)
-                    part["image"] = f"/static/uploads/{filename}"
-                except Exception as e:
-                    print(f"Error saving file: {e}")
+        image_path = save_part_image(request.files.get('image'))
         
-        save_catalogue(catalogue_items)
+        with catalogue_store.lock():
+            part = thaw(catalogue_store.get(part_id))
+            if part:
+                # Update part details
+                part["name"] = request.form.get("name", "").strip()
+                part["category"] = request.form.get("category", "").strip()
+                part["description"] = request.form.get("description", "").strip()
+                
+                try:
+                    part["price"] = float(request.form.get("price", "0"))
+                except ValueError:
+                    part["price"] = 0.0
+                
+                try:
+                    part["stock"] = int(request.form.get("stock", "0"))
+                except ValueError:
+                    part["stock"] = 0
+                
+                if image_path:
+                    part["image"] = image_path
+                
+                catalogue_store.upsert(part)
         return redirect(url_for("catalogue"))
     
     return render_template("edit_part.html", part=part)
@@ -695,49 +795,28 @@ def edit_catalogue_part(part_id):
 @app.route("/catalogue/export", methods=["GET"])
 @admin_required
 def export_catalogue():
-    """Export catalogue to CSV"""
-    from datetime import datetime
-    catalogue_items = load_catalogue()
-    
-    # Create CSV in memory using BytesIO for binary mode
-    output = BytesIO()
-    text_stream = output.write
-    
-    # Manually write CSV content as bytes
-    lines = []
-    lines.append("Part ID,Name,Category,Price,Stock,Description,Image\n")
-    
-    for part in catalogue_items:
-        # Escape quotes and wrap fields with quotes
-        row = [
-            f'"{part.get("part_id", "").replace(chr(34), chr(34)+chr(34))}"',
-            f'"{part.get("name", "").replace(chr(34), chr(34)+chr(34))}"',
-            f'"{part.get("category", "").replace(chr(34), chr(34)+chr(34))}"',
-            str(part.get("price", "")),
-            str(part.get("stock", "")),
-            f'"{part.get("description", "").replace(chr(34), chr(34)+chr(34))}"',
-            f'"{part.get("image", "").replace(chr(34), chr(34)+chr(34))}"'
-        ]
-        lines.append(",".join(row) + "\n")
-    
-    # Write as bytes
-    csv_content = "".join(lines)
-    output.write(csv_content.encode('utf-8'))
-    output.seek(0)
+    """Export catalogue to CSV, streamed row by row (gzip-compressed for large catalogues)"""
+    catalogue_items = catalogue_store.snapshot()
+    headers = ["Part ID", "Name", "Category", "Price", "Stock", "Description", "Image"]
+    rows = (
+        [part.get("part_id", ""), part.get("name", ""), part.get("category", ""), part.get("price", ""),
+         part.get("stock", ""), part.get("description", ""), part.get("image", "")]
+        for part in catalogue_items
+    )
+    body = csv_chunks(headers, rows)
     
     filename = f"catalogue_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    response_headers = {"Content-Disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding"}
+    if wants_gzip(request, len(catalogue_items)):
+        body = gzip_chunks(body)
+        response_headers["Content-Encoding"] = "gzip"
     
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="text/csv"
-    )
+    return Response(stream_with_context(body), mimetype="text/csv", headers=response_headers)
 
 @app.route("/catalogue/import", methods=["POST"])
 @admin_required
 def import_catalogue():
-    """Import parts from CSV or Excel file"""
+    """Start a background import of parts from a CSV or Excel file"""
     try:
         if 'file' not in request.files:
             return redirect(url_for('catalogue'))
@@ -747,138 +826,40 @@ def import_catalogue():
             return redirect(url_for('catalogue'))
         
         filename = file.filename.lower()
-        catalogue_items = load_catalogue()
-        rows_processed = 0
-        rows_added = 0
-        rows_updated = 0
-        
-        # Handle Excel files
         if filename.endswith(('.xlsx', '.xls')):
             if not HAS_OPENPYXL:
                 return redirect(url_for('catalogue'))
-            
-            try:
-                workbook = load_workbook(file)
-                worksheet = workbook.active
-                
-                for idx, row in enumerate(worksheet.iter_rows(values_only=True), 1):
-                    if idx == 1:  # Skip header
-                        continue
-                    
-                    if not row or not row[0]:  # Skip empty rows
-                        continue
-                    
-                    rows_processed += 1
-                    part_id = str(row[0]).strip()
-                    
-                    # Check if part exists
-                    existing = next((p for p in catalogue_items if p["part_id"] == part_id), None)
-                    
-                    # Parse values
-                    try:
-                        price = float(row[3]) if row[3] else 0.0
-                    except (ValueError, TypeError):
-                        price = 0.0
-                    
-                    try:
-                        stock = int(row[4]) if row[4] else 0
-                    except (ValueError, TypeError):
-                        stock = 0
-                    
-                    part_data = {
-                        "part_id": part_id,
-                        "name": str(row[1]).strip() if row[1] else "",
-                        "category": str(row[2]).strip() if row[2] else "",
-                        "price": price,
-                        "stock": stock,
-                        "description": str(row[5]).strip() if len(row) > 5 and row[5] else "",
-                        "image": str(row[6]).strip() if len(row) > 6 and row[6] else ""
-                    }
-                    
-                    if existing:
-                        existing.update(part_data)
-                        rows_updated += 1
-                    else:
-                        catalogue_items.append(part_data)
-                        rows_added += 1
-                
-                workbook.close()
-            except Exception as e:
-                print(f"Error reading Excel: {e}")
-                return redirect(url_for('catalogue'))
-        
-        # Handle CSV files
-        elif filename.endswith('.csv'):
-            try:
-                file.seek(0)
-                stream = file.read().decode('utf-8')
-                reader = csv.reader(stream.splitlines())
-                
-                for idx, row in enumerate(reader):
-                    if idx == 0:  # Skip header
-                        continue
-                    
-                    if not row or not row[0].strip():
-                        continue
-                    
-                    rows_processed += 1
-                    part_id = row[0].strip()
-                    
-                    # Check if part exists
-                    existing = next((p for p in catalogue_items if p["part_id"] == part_id), None)
-                    
-                    # Parse values
-                    try:
-                        price = float(row[3]) if len(row) > 3 and row[3] else 0.0
-                    except (ValueError, TypeError):
-                        price = 0.0
-                    
-                    try:
-                        stock = int(row[4]) if len(row) > 4 and row[4] else 0
-                    except (ValueError, TypeError):
-                        stock = 0
-                    
-                    part_data = {
-                        "part_id": part_id,
-                        "name": row[1].strip() if len(row) > 1 else "",
-                        "category": row[2].strip() if len(row) > 2 else "",
-                        "price": price,
-                        "stock": stock,
-                        "description": row[5].strip() if len(row) > 5 else "",
-                        "image": row[6].strip() if len(row) > 6 else ""
-                    }
-                    
-                    if existing:
-                        existing.update(part_data)
-                        rows_updated += 1
-                    else:
-                        catalogue_items.append(part_data)
-                        rows_added += 1
-            except Exception as e:
-                print(f"Error reading CSV: {e}")
-                flash(f"Error reading CSV file: {str(e)}", "error")
-                return redirect(url_for('catalogue'))
-        
-        # Save updated catalogue
-        if rows_processed > 0:
-            save_catalogue(catalogue_items)
-            flash(f"Import successful! Added {rows_added} parts, Updated {rows_updated} parts", "success")
-        else:
-            flash("No valid data found in file", "warning")
+        elif not filename.endswith('.csv'):
+            flash("Please upload a .csv or .xlsx file", "warning")
+            return redirect(url_for('catalogue'))
         
-        return redirect(url_for('catalogue'))
+        # The upload is spooled to disk and imported on a background thread
+        job_id = start_import_job(catalogue_store, file, file.filename)
+        status_url = url_for('import_status', job_id=job_id)
+        if request.accept_mimetypes.best == "application/json":
+            return {"job_id": job_id, "status_url": status_url}, 202
+        flash(f"Import of {file.filename} started (job {job_id})", "success")
+        return redirect(url_for('catalogue', import_job=job_id))
     except Exception as e:
         print(f"Error importing catalogue: {e}")
         flash(f"Error importing catalogue: {str(e)}", "error")
         return redirect(url_for('catalogue'))
 
+@app.route("/catalogue/import/<job_id>")
+@admin_required
+def import_status(job_id):
+    """Progress and per-row report of a background catalogue import"""
+    job = read_job(job_id)
+    if not job:
+        return {"error": "Import job not found"}, 404
+    return job
+
 # ==================== ORDERS & CART ROUTES ====================
 
 @app.route("/orders", methods=["GET", "POST"])
 @login_required
 def orders():
     """Display orders and shopping cart"""
-    orders_list = load_orders()
     cart = load_cart()
     search_query = request.args.get("search", "").strip().lower()
 
@@ -893,31 +874,24 @@ def orders():
 
             try:
                 price_float = float(price)
-                quantity_int = int(quantity)
             except ValueError:
                 price_float = 0.0
-                quantity_int = 1
+            quantity_int = parse_quantity(quantity)
 
-            if item_name and price_float > 0:
-                # Check if item already in cart
-                existing = next((item for item in cart if item["item_name"] == item_name), None)
-                if existing:
-                    existing["quantity"] += quantity_int
-                else:
-                    cart.append({
-                        "item_name": item_name,
-                        "price": price_float,
-                        "quantity": quantity_int
-                    })
-                save_cart(cart)
+            if quantity_int is None:
+                flash("Quantity must be a whole number of at least 1.", "error")
+            elif item_name and price_float > 0:
+                add_to_cart(item_name, price_float, quantity_int, cart_part(item_name))
 
             return redirect(url_for("orders"))
 
         # Remove item from cart
         if action == "remove_from_cart":
             item_name = request.form.get("item_name", "").strip()
-            cart = [item for item in cart if item["item_name"] != item_name]
-            save_cart(cart)
+            line = next((i for i in load_cart() if i["item_name"] == item_name), None)
+            session["cart_version"] = carts.remove(cart_owner(), item_name, session.get("cart_version", 0))
+            if line and line.get("part_id"):
+                reservations.release(cart_owner(), [line["part_id"]])
             return redirect(url_for("orders"))
 
         # Update cart item quantity
@@ -933,28 +907,33 @@ def orders():
             if quantity_int < 1:
                 quantity_int = 1
 
-            for item in cart:
-                if item["item_name"] == item_name:
-                    item["quantity"] = quantity_int
-                    break
-
-            save_cart(cart)
+            line = next((i for i in load_cart() if i["item_name"] == item_name), None)
+            part = catalogue_store.get(line["part_id"]) if line and line.get("part_id") else None
+            if part is not None:
+                try:
+                    reservations.reserve(cart_owner(), part, quantity_int)
+                except StockError as e:
+                    flash(f"Only {e.shortages[0][2]} x {part['name']} available.", "error")
+                    return redirect(url_for("orders"))
+            session["cart_version"] = carts.set_quantity(
+                cart_owner(), item_name, quantity_int, session.get("cart_version", 0))
             return redirect(url_for("orders"))
 
         # Checkout - convert cart to order
         if action == "checkout":
+            owner = cart_owner()
+            # Taking the items empties the cart, so a double-submitted checkout finds it empty
+            cart, session["cart_version"] = carts.take(owner, session.get("cart_version", 0))
             if cart:
                 import datetime
-                order_id = f"ORD{len(orders_list) + 1001}"
-                
                 total = sum(item["price"] * item["quantity"] for item in cart)
-                
+            
                 # Get customer details
                 customer_name = request.form.get("customer_name", "Guest").strip()
                 customer_phone = request.form.get("customer_phone", "").strip()
                 customer_email = request.form.get("customer_email", "").strip()
                 order_notes = request.form.get("order_notes", "").strip()
-                
+            
                 # Delivery option
                 delivery_option = request.form.get("delivery_option", "pickup").strip()
                 delivery_address = ""
@@ -963,30 +942,40 @@ def orders():
                     delivery_address = request.form.get("delivery_address", "").strip()
                     delivery_fee = 5.00
                     total += delivery_fee
-                
-                new_order = {
-                    "order_id": order_id,
-                    "customer_name": customer_name,
-                    "customer_phone": customer_phone,
-                    "customer_email": customer_email,
-                    "order_notes": order_notes,
-                    "items": cart.copy(),
-                    "total": round(total, 2),
-                    "status": "Pending",
-                    "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "delivery_option": delivery_option,
-                    "delivery_address": delivery_address,
-                    "delivery_fee": delivery_fee,
-                    "delivery_status": "Preparing" if delivery_option == "delivery" else "",
-                    "placed_by": session.get("username", "Unknown")
-                }
-                
-                orders_list.append(new_order)
-                save_orders(orders_list)
-                
-                # Clear cart after checkout
-                save_cart([])
-                cart = []
+            
+                def make_order():
+                    # Called inside the checkout transaction, once stock is known to be there
+                    return {
+                        "order_id": f"ORD{order_numbers.next()}",
+                        "customer_name": customer_name,
+                        "customer_phone": customer_phone,
+                        "customer_email": customer_email,
+                        "order_notes": order_notes,
+                        "items": cart,
+                        "total": round(total, 2),
+                        "status": "Pending",
+                        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "delivery_option": delivery_option,
+                        "delivery_address": delivery_address,
+                        "delivery_fee": delivery_fee,
+                        "delivery_status": "Preparing" if delivery_option == "delivery" else "",
+                        "placed_by": session.get("username", "Unknown")
+                    }
+            
+                try:
+                    place_order(catalogue_store, orders_store, reservations, owner, cart, make_order,
+                                log=checkout_log)
+                except Exception as e:
+                    # Nothing was written: give the user their cart back
+                    for item in cart:
+                        session["cart_version"] = carts.add(owner, item["item_name"], item["price"], item["quantity"],
+                                                            session["cart_version"], part_id=item.get("part_id"))
+                    if isinstance(e, StockError):
+                        flash(f"Not enough stock to place this order: {e}.", "error")
+                    elif isinstance(e, ValueError):
+                        flash(f"Could not place this order: {e}.", "error")
+                    else:
+                        raise
 
             return redirect(url_for("orders"))
 
@@ -995,10 +984,11 @@ def orders():
             order_id = request.form.get("order_id", "").strip()
             new_status = request.form.get("status", "").strip()
 
-            order = next((o for o in orders_list if o["order_id"] == order_id), None)
-            if order and new_status:
-                order["status"] = new_status
-                save_orders(orders_list)
+            with orders_store.lock():
+                order = thaw(orders_store.get(order_id))
+                if order and new_status:
+                    order["status"] = new_status
+                    orders_store.upsert(order)
 
             return redirect(url_for("orders"))
 
@@ -1006,56 +996,94 @@ def orders():
     cart_total = sum(item["price"] * item["quantity"] for item in cart)
     cart_item_count = sum(item["quantity"] for item in cart)
 
-    # Filter orders by search
-    filtered_orders = orders_list
-    if search_query:
-        filtered_orders = [
-            o for o in orders_list
-            if search_query in o.get("order_id", "").lower()
-            or search_query in o.get("customer_name", "").lower()
-            or search_query in o.get("status", "").lower()
-        ]
-
-    # Sort orders by most recent
-    filtered_orders = sorted(filtered_orders, key=lambda x: x.get("date", ""), reverse=True)
+    # One page of orders, newest first, walked from the after/before cursor in the date index
+    filters = {name: request.args.get(name, "").strip() for name in ORDER_FILTERS}
+    after = parse_order_cursor(request.args.get("after"))
+    before = None if after else parse_order_cursor(request.args.get("before"))
+    try:
+        per_page = min(max(int(request.args.get("per_page", ORDERS_PAGE_SIZE)), 1), ORDERS_MAX_PAGE_SIZE)
+    except ValueError:
+        per_page = ORDERS_PAGE_SIZE
+
+    # Archived orders are only read when asked for
+    include_archived = request.args.get("archived") == "1"
+    matches = order_matches(search_query, filters)
+
+    def orders_page():
+        page, more = orders_index.page(filters, after=after, before=before, limit=per_page,
+                                       match=matches if search_query else None)
+        if not include_archived:
+            return page, more
+        # Same cursor in the archive, then keep the per_page rows nearest the cursor
+        # (orders caught mid-archive are in both; the store's copy wins)
+        archived, archived_more = order_archive.page(
+            after=after, before=before, limit=per_page,
+            match=lambda o: matches(o) and orders_store.get(o["order_id"]) is None)
+        merged = sorted(page + archived, key=orders_index.cursor, reverse=True)
+        rows = merged[:per_page] if before is None else merged[-per_page:]
+        return rows, more or archived_more or len(merged) > per_page
+
+    # version() also brings the index up to date with other workers' writes
+    page_orders, has_more = query_cache.cached(
+        ("orders", search_query, tuple(filters.values()), after, before, per_page, orders_store.version(),
+         order_archive.version() if include_archived else None),
+        orders_page)
+
+    # Links keep the filters; "older" continues after the last row, "newer" ends before the first
+    link_args = {k: v for k, v in dict(filters, search=search_query).items() if v}
+    if include_archived:
+        link_args["archived"] = "1"
+    if per_page != ORDERS_PAGE_SIZE:
+        link_args["per_page"] = per_page
+    older_url = newer_url = None
+    if page_orders and (has_more if before is None else True):
+        older_url = url_for("orders", after=order_cursor(page_orders[-1]), **link_args)
+    if page_orders and (has_more if before is not None else after is not None):
+        newer_url = url_for("orders", before=order_cursor(page_orders[0]), **link_args)
 
     return render_template(
         "orders.html",
-        orders=filtered_orders,
+        orders=page_orders,
         cart=cart,
         cart_total=round(cart_total, 2),
         cart_item_count=cart_item_count,
-        search_query=search_query
+        search_query=search_query,
+        filters=filters,
+        include_archived=include_archived,
+        filter_options={name: orders_index.values(name) for name in ORDER_FILTERS},
+        older_url=older_url,
+        newer_url=newer_url,
+        first_url=url_for("orders", **link_args) if after or before else None,
     )
 
 @app.route("/orders/delete/<order_id>", methods=["POST"])
 @login_required
 def delete_order(order_id):
     """Delete an order"""
-    orders_list = load_orders()
-    orders_list = [o for o in orders_list if o["order_id"] != order_id]
-    save_orders(orders_list)
+    orders_store.delete(order_id)
     return redirect(url_for("orders"))
 
 @app.route("/orders/edit/<order_id>", methods=["GET", "POST"])
 @login_required
 def edit_order(order_id):
     """Edit an existing order"""
-    orders_list = load_orders()
-    order = next((o for o in orders_list if o["order_id"] == order_id), None)
+    order = thaw(orders_store.get(order_id))
     
     if not order:
         return redirect(url_for("orders"))
     
     if request.method == "POST":
-        # Update order details
-        order["customer_name"] = request.form.get("customer_name", "").strip()
-        order["customer_phone"] = request.form.get("customer_phone", "").strip()
-        order["customer_email"] = request.form.get("customer_email", "").strip()
-        order["order_notes"] = request.form.get("order_notes", "").strip()
-        order["status"] = request.form.get("status", "Pending").strip()
-        
-        save_orders(orders_list)
+        with orders_store.lock():
+            order = thaw(orders_store.get(order_id))
+            if order:
+                # Update order details
+                order["customer_name"] = request.form.get("customer_name", "").strip()
+                order["customer_phone"] = request.form.get("customer_phone", "").strip()
+                order["customer_email"] = request.form.get("customer_email", "").strip()
+                order["order_notes"] = request.form.get("order_notes", "").strip()
+                order["status"] = request.form.get("status", "Pending").strip()
+                
+                orders_store.upsert(order)
         return redirect(url_for("orders"))
     
     return render_template("edit_order.html", order=order)
@@ -1124,13 +1152,11 @@ def tickets():
             return redirect(url_for("tickets"))
         
         ticket = SupportTicket(name, email, issue_type, description, phone)
-        tickets_list = load_support_tickets()
-        tickets_list.append(ticket.to_dict())
-        save_support_tickets(tickets_list)
+        tickets_store.upsert(ticket.to_dict())
         flash(f"Support ticket {ticket.ticket_id} created successfully! We'll respond within 24 hours.", "success")
         return redirect(url_for("tickets"))
     
-    all_tickets = load_support_tickets()
+    all_tickets = tickets_store.snapshot()
     return render_template("tickets.html", tickets=all_tickets)
 
 @app.route("/status")
@@ -1165,26 +1191,47 @@ def search():
 @login_required
 def edit_ticket(ticket_id):
     """Edit an existing support ticket"""
-    tickets_list = load_support_tickets()
-    ticket = next((t for t in tickets_list if t.get("ticket_id") == ticket_id), None)
+    ticket = thaw(tickets_store.get(ticket_id))
     if not ticket:
         flash("Ticket not found!", "danger")
         return redirect(url_for("tickets"))
 
     if request.method == "POST":
-        ticket["name"] = request.form.get("name", "").strip()
-        ticket["email"] = request.form.get("email", "").strip()
-        ticket["phone"] = request.form.get("phone", "").strip()
-        ticket["issue_type"] = request.form.get("issue_type", "").strip()
-        ticket["description"] = request.form.get("description", "").strip()
-
-        save_support_tickets(tickets_list)
+        with tickets_store.lock():
+            ticket = thaw(tickets_store.get(ticket_id))
+            if ticket:
+                ticket["name"] = request.form.get("name", "").strip()
+                ticket["email"] = request.form.get("email", "").strip()
+                ticket["phone"] = request.form.get("phone", "").strip()
+                ticket["issue_type"] = request.form.get("issue_type", "").strip()
+                ticket["description"] = request.form.get("description", "").strip()
+
+                tickets_store.upsert(ticket)
         flash(f"Support ticket {ticket_id} updated successfully!", "success")
         return redirect(url_for("tickets"))
 
     return render_template("edit_ticket.html", ticket=ticket)
 
 
+@app.route("/admin/cache-stats")
+@admin_required
+def admin_cache_stats():
+    """Store cache hit/miss counters for this worker"""
+    return {
+        "stores": cache_stats(),
+        "search": catalogue_search.stats(),
+        "fuzzy": catalogue_fuzzy.stats(),
+        "queries": query_cache.stats(),
+        "exports": export_cache.stats(),
+        "carts": carts.stats(),
+        "order_ids": order_numbers.stats(),
+        "sorts": catalogue_sorts.stats(),
+        "orders_index": orders_index.stats(),
+        "archive": order_archive.stats(),
+        "recommendations": co_purchases.stats(),
+    }
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Custom 404 error page"""
@@ -1197,11 +1244,6 @@ def page_not_found(e):
 @login_required
 def deliveries():
     """Delivery management page"""
-    orders_list = load_orders()
-    
-    # Filter only delivery orders
-    delivery_orders = [o for o in orders_list if o.get("delivery_option") == "delivery"]
-    
     if request.method == "POST" and session.get("role") == "admin":
         action = request.form.get("action", "").strip()
         
@@ -1209,172 +1251,259 @@ def deliveries():
             order_id = request.form.get("order_id", "").strip()
             new_status = request.form.get("delivery_status", "").strip()
             
-            order = next((o for o in orders_list if o["order_id"] == order_id), None)
-            if order and new_status:
-                order["delivery_status"] = new_status
-                save_orders(orders_list)
+            with orders_store.lock():
+                order = thaw(orders_store.get(order_id))
+                if order and new_status:
+                    order["delivery_status"] = new_status
+                    orders_store.upsert(order)
             
             return redirect(url_for("deliveries"))
     
-    # For regular users, only show their own orders
+    # Regular users only see their own orders; anyone can narrow to one delivery status
+    criteria = {"delivery_option": "delivery"}
     if session.get("role") != "admin":
-        current_user = session.get("username", "")
-        delivery_orders = [o for o in delivery_orders if o.get("placed_by") == current_user]
-    
-    # Sort by most recent
-    delivery_orders = sorted(delivery_orders, key=lambda x: x.get("date", ""), reverse=True)
+        criteria["placed_by"] = session.get("username", "")
+    status_filter = request.args.get("delivery_status", "").strip()
+    if status_filter:
+        criteria["delivery_status"] = status_filter
+    # Most recent first, straight from the date-ordered index (version() first brings
+    # the store, and so the index, up to date with this and other workers' writes)
+    orders_store.version()
+    delivery_orders = orders_index.records(criteria)
     
     return render_template(
         "deliveries.html",
         delivery_orders=delivery_orders,
+        status_filter=status_filter,
         is_admin=session.get("role") == "admin"
     )
 
 
+def job_export_row(job):
+    return [
+        job.get("license_plate", ""),
+        job.get("status", ""),
+        job.get("problem", ""),
+        ", ".join(job.get("parts_used", [])) if job.get("parts_used") else "",
+        job.get("remarks", ""),
+        job.get("assigned_to", ""),
+    ]
+
+def rewards_export_row(c):
+    return [
+        c.get("phone_number", ""),
+        c.get("license_plate", ""),
+        c.get("name", ""),
+        f"{c.get('total_cost', 0):.2f}",
+        int(c.get("total_cost", 0)),
+        c.get("vouchers_redeemed", 0),
+    ]
+
+JOB_EXPORT = Export("job_cards", "Job Cards", [
+    ("License Plate", 15), ("Status", 12), ("Problem", 20),
+    ("Parts Used", 25), ("Remarks", 20), ("Assigned To", 15),
+], job_export_row)
+
+REWARDS_EXPORT = Export("customer_rewards", "Customers", [
+    ("Phone Number", 15), ("License Plate", 15), ("Name", 15),
+    ("Total Cost ($)", 15), ("Current Points", 15), ("Vouchers Redeemed", 18),
+], rewards_export_row)
+
+def order_export_row(o):
+    return [
+        o.get("order_id", ""),
+        o.get("date", ""),
+        o.get("customer_name", ""),
+        o.get("customer_phone", ""),
+        ", ".join(f"{item['item_name']} x{item['quantity']}" for item in o.get("items", [])),
+        o.get("total", 0),
+        o.get("status", ""),
+        o.get("delivery_option", ""),
+        o.get("delivery_status", ""),
+        o.get("placed_by", ""),
+        "Yes" if o.get("archived") else "",
+    ]
+
+ORDERS_EXPORT = Export("orders", "Orders", [
+    ("Order ID", 12), ("Date", 20), ("Customer", 20), ("Phone", 15), ("Items", 40), ("Total ($)", 10),
+    ("Status", 12), ("Delivery", 10), ("Delivery Status", 16), ("Placed By", 15), ("Archived", 10),
+], order_export_row)
+
+def job_matches(search_query):
+    """Predicate for job cards matching a lower-cased search query (None when there is none)"""
+    if not search_query:
+        return None
+    return lambda j: (
+        search_query in j.get("license_plate", "").lower()
+        or search_query in j.get("status", "").lower()
+        or search_query in j.get("problem", "").lower()
+        or search_query in j.get("remarks", "").lower()
+        or search_query in j.get("assigned_to", "").lower()
+        or any(search_query in part.lower() for part in j.get("parts_used", []))
+    )
+
+def customer_matches(search_query):
+    """Predicate for reward customers matching a lower-cased search query (None when there is none)"""
+    if not search_query:
+        return None
+    return lambda c: (
+        search_query in c.get("phone_number", "").lower()
+        or search_query in c.get("license_plate", "").lower()
+        or search_query in c.get("name", "").lower()
+    )
+
+def export_format():
+    """Requested export format from the form, defaulting to Excel"""
+    fmt = request.form.get("format", "xlsx").strip().lower()
+    return fmt if fmt in EXPORT_FORMATS else None
+
+
 @app.route("/export-jobs", methods=["POST"])
 @login_required
 def export_jobs():
-    """Export job cards to Excel file, respecting search filters"""
-    if not HAS_OPENPYXL:
+    """Export job cards to Excel, CSV or JSON Lines, respecting search filters"""
+    fmt = export_format()
+    if fmt is None:
+        flash("Unknown export format.", "error")
+        return redirect(url_for("home"))
+    if fmt == "xlsx" and not HAS_OPENPYXL:
         flash("Excel export requires openpyxl library. Please install it.", "error")
         return redirect(url_for("home"))
     
-    jobs = load_jobs()
     search_query = request.form.get("search_query", "").strip().lower()
-    
-    # Filter jobs based on search query
-    if search_query:
-        jobs = [
-            j for j in jobs
-            if search_query in j.get("license_plate", "").lower()
-            or search_query in j.get("status", "").lower()
-            or search_query in j.get("problem", "").lower()
-            or search_query in j.get("remarks", "").lower()
-            or search_query in j.get("assigned_to", "").lower()
-            or any(search_query in part.lower() for part in j.get("parts_used", []))
-        ]
-    
-    # Create Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Job Cards"
-    
-    # Add headers
-    headers = ["License Plate", "Status", "Problem", "Parts Used", "Remarks", "Assigned To"]
-    ws.append(headers)
-    
-    # Style header row
-    from openpyxl.styles import Font, PatternFill
-    header_fill = PatternFill(start_color="FF6A3D", end_color="FF6A3D", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-    
-    # Add data rows
-    for job in jobs:
-        ws.append([
-            job.get("license_plate", ""),
-            job.get("status", ""),
-            job.get("problem", ""),
-            ", ".join(job.get("parts_used", [])) if job.get("parts_used") else "",
-            job.get("remarks", ""),
-            job.get("assigned_to", "")
-        ])
-    
-    # Adjust column widths
-    ws.column_dimensions["A"].width = 15
-    ws.column_dimensions["B"].width = 12
-    ws.column_dimensions["C"].width = 20
-    ws.column_dimensions["D"].width = 25
-    ws.column_dimensions["E"].width = 20
-    ws.column_dimensions["F"].width = 15
-    
-    # Save to BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    # Return file download
-    filename = f"job_cards_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    stem = f"job_cards_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    # Version first: a write in between only makes the cached file newer than its key
+    version = jobs_store.durable_version()
+    return export_response(JOB_EXPORT, fmt, jobs_store.snapshot(), job_matches(search_query), stem,
+                           cache=export_cache, cache_key=(search_query, version) if version is not None else None)
 
 
 @app.route("/export-rewards", methods=["POST"])
 @login_required
 def export_rewards():
-    """Export customer rewards data to Excel file, respecting search filters"""
-    if not HAS_OPENPYXL:
+    """Export customer rewards data to Excel, CSV or JSON Lines, respecting search filters"""
+    fmt = export_format()
+    if fmt is None:
+        flash("Unknown export format.", "error")
+        return redirect(url_for("rewards"))
+    if fmt == "xlsx" and not HAS_OPENPYXL:
         flash("Excel export requires openpyxl library. Please install it.", "error")
         return redirect(url_for("rewards"))
     
-    customers = load_rewards()
     search_query = request.form.get("search_query", "").strip().lower()
-    
-    # Filter customers based on search query
-    if search_query:
-        customers = [
-            c for c in customers
-            if search_query in c.get("phone_number", "").lower()
-            or search_query in c.get("license_plate", "").lower()
-            or search_query in c.get("name", "").lower()
-        ]
-    
-    # Create Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Customers"
-    
-    # Add headers
-    headers = ["Phone Number", "License Plate", "Name", "Total Cost ($)", "Current Points", "Vouchers Redeemed"]
-    ws.append(headers)
-    
-    # Style header row
-    from openpyxl.styles import Font, PatternFill
-    header_fill = PatternFill(start_color="FF6A3D", end_color="FF6A3D", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-    
-    # Add data rows
-    for c in customers:
-        current_points = int(c.get("total_cost", 0))
-        ws.append([
-            c.get("phone_number", ""),
-            c.get("license_plate", ""),
-            c.get("name", ""),
-            f"{c.get('total_cost', 0):.2f}",
-            current_points,
-            c.get("vouchers_redeemed", 0)
-        ])
-    
-    # Adjust column widths
-    ws.column_dimensions["A"].width = 15
-    ws.column_dimensions["B"].width = 15
-    ws.column_dimensions["C"].width = 15
-    ws.column_dimensions["D"].width = 15
-    ws.column_dimensions["E"].width = 15
-    ws.column_dimensions["F"].width = 18
-    
-    # Save to BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    # Return file download
-    filename = f"customer_rewards_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    stem = f"customer_rewards_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    # Version first: a write in between only makes the cached file newer than its key
+    version = rewards_store.durable_version()
+    return export_response(REWARDS_EXPORT, fmt, rewards_store.snapshot(), customer_matches(search_query), stem,
+                           cache=export_cache, cache_key=(search_query, version) if version is not None else None)
+
+
+@app.route("/export-orders", methods=["POST"])
+@login_required
+def export_orders():
+    """Export orders to Excel, CSV or JSON Lines, respecting search filters, archived orders on request"""
+    fmt = export_format()
+    if fmt is None:
+        flash("Unknown export format.", "error")
+        return redirect(url_for("orders"))
+    if fmt == "xlsx" and not HAS_OPENPYXL:
+        flash("Excel export requires openpyxl library. Please install it.", "error")
+        return redirect(url_for("orders"))
+
+    search_query = request.form.get("search_query", "").strip().lower()
+    filters = {name: request.form.get(name, "").strip() for name in ORDER_FILTERS}
+    include_archived = request.form.get("archived") == "1"
+    stem = f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    version = orders_store.durable_version()
+    records = orders_store.snapshot()
+    if include_archived:
+        # Streamed a month at a time after the active orders; mid-archive duplicates are skipped
+        active = {o["order_id"] for o in records}
+        records = itertools.chain(records, (o for o in order_archive.records() if o["order_id"] not in active))
+    cache_key = None
+    if version is not None:
+        cache_key = (search_query, tuple(filters.values()), version,
+                     order_archive.version() if include_archived else None)
+    return export_response(ORDERS_EXPORT, fmt, records, order_matches(search_query, filters), stem,
+                           cache=export_cache, cache_key=cache_key)
+
+
+@app.cli.command("archive-orders")
+@click.option("--dry-run", is_flag=True, help="Count the orders that would be archived without moving them.")
+def archive_orders_command(dry_run):
+    """Move finished orders out of the orders store into compressed monthly archive segments"""
+    now = time.time()
+    with orders_store.lock():
+        candidates = [o for o in orders_store.snapshot() if archivable(o, now)]
+        if dry_run or not candidates:
+            click.echo(f"{len(candidates)} orders to archive")
+            return
+        # Segments and manifest first, so an interrupted run loses nothing
+        segments = order_archive.write(candidates)
+        orders_store.delete_many([o["order_id"] for o in candidates])
+    click.echo(f"Archived {len(candidates)} orders into {len(segments)} segments; "
+               f"{len(orders_store)} orders remain active")
+
+
+@app.cli.command("migrate-sqlite")
+@click.option("--force", is_flag=True, help="Overwrite tables that already contain data.")
+def migrate_sqlite_command(force):
+    """Copy every *_data.json file into the SQLite database"""
+    for name, count in migrate_json_to_sqlite(force=force):
+        if count is None:
+            click.echo(f"{name}: already migrated, skipped (use --force to overwrite)")
+        else:
+            click.echo(f"{name}: {count} records")
+
+
+@app.cli.command("fingerprint-images")
+def fingerprint_images_command():
+    """Move catalogue images uploaded before content addressing to hash-named files"""
+    prefix = "/static/uploads/"
+    moved = 0
+    for part in catalogue_store.snapshot():
+        image = part.get("image") or ""
+        name = image[len(prefix):]
+        if not image.startswith(prefix) or "/" in name or is_fingerprinted(name):
+            continue
+        path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+        try:
+            with open(path, "rb") as f:
+                url = store_image_stream(f, app.config['UPLOAD_FOLDER'])
+        except (OSError, ValueError) as e:
+            click.echo(f"{part['part_id']}: skipped {image} ({e})")
+            continue
+        with catalogue_store.lock():
+            current = thaw(catalogue_store.get(part["part_id"]))
+            if current and current.get("image") == image:
+                current["image"] = url
+                catalogue_store.upsert(current)
+                moved += 1
+                click.echo(f"{part['part_id']}: {image} -> {url}")
+    click.echo(f"{moved} images fingerprinted; run clean-uploads to remove the old files")
+
+
+@app.cli.command("clean-uploads")
+@click.option("--dry-run", is_flag=True, help="List orphaned files without deleting them.")
+@click.option("--min-age", default=3600, show_default=True, help="Keep files modified within this many seconds.")
+def clean_uploads_command(dry_run, min_age):
+    """Delete uploaded files no catalogue part or user profile refers to"""
+    referenced = [part.get("image") for part in catalogue_store.snapshot()]
+    referenced += [user.get("face_image") for user in users_store.snapshot()]
+    orphans = orphaned_uploads(app.config['UPLOAD_FOLDER'], referenced, min_age=min_age)
+    freed = 0
+    for path in orphans:
+        size = os.path.getsize(path)
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError as e:
+                click.echo(f"Could not remove {path}: {e}")
+                continue
+        freed += size
+        click.echo(path)
+    action = "would free" if dry_run else "freed"
+    click.echo(f"{len(orphans)} orphaned files, {action} {freed / 1024:.1f} KiB")
 
 
 if __name__ == "__main__":
@@ -5,12 +5,13 @@ from werkzeug.utils import secure_filename
 from datetime import datetime
 from io import BytesIO
 import base64
-import json
 import os
 import re
 import uuid
 import requests
 
+from store import open_store, thaw
+
 FACE_API_ENDPOINT = os.environ.get("FACE_API_ENDPOINT", "").rstrip("/")
 FACE_API_KEY = os.environ.get("FACE_API_KEY", "")
 FACE_API_PERSON_GROUP = os.environ.get("FACE_API_PERSON_GROUP", "wdp-users")
@@ -26,30 +27,36 @@ FACE_UPLOAD_FOLDER = os.path.join('static', 'uploads', 'faces')
 
 os.makedirs(FACE_UPLOAD_FOLDER, exist_ok=True)
 
+users_store = open_store(
+    "users", USERS_FILE, key="id",
+    indexes={"username": lambda u: u["username"].lower(), "email": lambda u: u["email"].lower()},
+)
+
 def load_users():
     """Load users from JSON file"""
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+    return users_store.load()
 
 def save_users(users):
     """Save users to JSON file"""
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=2)
+    users_store.save(users)
 
 def get_user_by_username(username):
     """Get user by username"""
-    users = load_users()
-    return next((u for u in users if u['username'].lower() == username.lower()), None)
+    matches = users_store.find("username", username.lower())
+    return matches[0] if matches else None
 
 def get_user_by_id(user_id):
     """Get user by ID"""
-    users = load_users()
-    return next((u for u in users if u['id'] == user_id), None)
+    return users_store.get(user_id)
+
+def update_user(user_id, **changes):
+    """Apply field changes to a stored user under the users lock"""
+    with users_store.lock():
+        user = thaw(users_store.get(user_id))
+        if user:
+            user.update(changes)
+            users_store.upsert(user)
+        return user
 
 def decode_image_data_url(data_url):
     if not data_url or not data_url.startswith("data:image/"):
@@ -238,10 +245,8 @@ def register():
             flash('Username already exists', 'danger')
             return render_template('register.html')
         
-        users = load_users()
-        
         # Check if email exists
-        if any(u['email'].lower() == email.lower() for u in users):
+        if users_store.find("email", email.lower()):
             flash('Email already registered', 'danger')
             return render_template('register.html')
         
@@ -261,7 +266,7 @@ def register():
 
         # Create new user
         new_user = {
-            'id': max([u['id'] for u in users], default=0) + 1,
+            'id': None,
             'username': username,
             'email': email,
             'password': generate_password_hash(password),
@@ -285,8 +290,13 @@ def register():
         else:
             flash('Face service not configured. Face login will be unavailable.', 'warning')
         
-        users.append(new_user)
-        save_users(users)
+        with users_store.lock():
+            # Re-check under the lock, another worker may have registered meanwhile
+            if get_user_by_username(username) or users_store.find("email", email.lower()):
+                flash('Username or email already registered', 'danger')
+                return render_template('register.html')
+            new_user['id'] = max([u['id'] for u in users_store.snapshot()], default=0) + 1
+            users_store.upsert(new_user)
         
         flash('Registration successful! Please login', 'success')
         return redirect(url_for('auth.login'))
@@ -437,8 +447,7 @@ def update_face():
         flash('No clear face detected. Please capture again.', 'danger')
         return redirect(url_for('auth.profile'))
 
-    users = load_users()
-    user = next((u for u in users if u['id'] == session['user_id']), None)
+    user = get_user_by_id(session['user_id'])
     if not user:
         flash('User not found', 'danger')
         return redirect(url_for('auth.logout'))
@@ -448,8 +457,6 @@ def update_face():
         flash('Face scan failed. Please try again.', 'danger')
         return redirect(url_for('auth.profile'))
 
-    user['face_image'] = face_image_path
-
     if face_api_configured():
         person_id = user.get('person_id')
         if not person_id:
@@ -461,14 +468,13 @@ def update_face():
         added, add_error = add_face_to_person(person_id, image_bytes)
         if added:
             train_person_group()
-            user['person_id'] = person_id
-            save_users(users)
+            update_user(user['id'], face_image=face_image_path, person_id=person_id)
             flash('Face scan updated successfully.', 'success')
             return redirect(url_for('auth.profile'))
         flash(f'Face service enrollment failed: {add_error}', 'danger')
         return redirect(url_for('auth.profile'))
 
-    save_users(users)
+    update_user(user['id'], face_image=face_image_path)
     flash('Face scan saved, but face service is not configured.', 'warning')
     return redirect(url_for('auth.profile'))
 
@@ -494,8 +500,7 @@ def update_password():
         flash('New passwords do not match', 'danger')
         return redirect(url_for('auth.profile'))
 
-    users = load_users()
-    user = next((u for u in users if u['id'] == session['user_id']), None)
+    user = get_user_by_id(session['user_id'])
     if not user:
         flash('User not found', 'danger')
         return redirect(url_for('auth.logout'))
@@ -504,7 +509,6 @@ def update_password():
         flash('Current password is incorrect', 'danger')
         return redirect(url_for('auth.profile'))
 
-    user['password'] = generate_password_hash(new_password)
-    save_users(users)
+    update_user(user['id'], password=generate_password_hash(new_password))
     flash('Password updated successfully.', 'success')
     return redirect(url_for('auth.profile'))
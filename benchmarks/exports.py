@@ -0,0 +1,121 @@
+# benchmarks/exports.py
+"""Throughput and peak memory of the job card export in each format.
+
+Usage: python benchmarks/exports.py [sizes] [formats]
+
+sizes defaults to 10000,100000,1000000 and formats to legacy,xlsx,csv,jsonl,
+where legacy is the old in-memory Workbook saved to a BytesIO. Each run
+happens in a fresh subprocess so ru_maxrss is that run's own high-water
+mark; the synthetic job cards are built before measuring starts, and
+"extra MB" is how far the export pushed peak RSS above them. Every run
+filters on a search query matching about half the cards.
+"""
+
+import io
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from exports import Export, HAS_OPENPYXL  # noqa: E402
+
+STATUSES = ["Pending", "In Progress", "Completed", "Awaiting Parts"]
+PROBLEMS = ["Brake noise", "Chain slack", "Engine stalls", "Flat tyre", "Battery flat", "Oil leak"]
+PARTS = ["P001", "P002", "P003", "P010", "P014", "P022"]
+MECHANICS = ["Ali", "Ben", "Chong", "Devi"]
+QUERY = "progress"
+
+JOB_EXPORT = Export("job_cards", "Job Cards", [
+    ("License Plate", 15), ("Status", 12), ("Problem", 20),
+    ("Parts Used", 25), ("Remarks", 20), ("Assigned To", 15),
+], lambda job: [job["license_plate"], job["status"], job["problem"],
+                ", ".join(job["parts_used"]), job["remarks"], job["assigned_to"]])
+
+
+def make_jobs(size, seed=1):
+    rng = random.Random(seed)
+    return [{
+        "license_plate": f"FB{i:07d}X",
+        "status": rng.choice(STATUSES[:2]) if i % 2 else rng.choice(STATUSES[2:]),
+        "problem": rng.choice(PROBLEMS),
+        "parts_used": rng.sample(PARTS, rng.randint(0, 3)),
+        "remarks": "Customer waiting" if i % 7 == 0 else "",
+        "assigned_to": rng.choice(MECHANICS),
+    } for i in range(size)]
+
+
+def matches(job):
+    return QUERY in job["status"].lower() or QUERY in job["problem"].lower()
+
+
+def legacy(jobs, out):
+    """The export_jobs body before the export engine, minus the Flask response."""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill
+
+    jobs = [j for j in jobs if matches(j)]
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Job Cards"
+    ws.append(JOB_EXPORT.headers)
+    for cell in ws[1]:
+        cell.fill = PatternFill(start_color="FF6A3D", end_color="FF6A3D", fill_type="solid")
+        cell.font = Font(bold=True, color="FFFFFF")
+    for job in jobs:
+        ws.append(JOB_EXPORT.row_of(job))
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    out.write(buffer.getvalue())
+
+
+def peak_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def child(size, fmt):
+    jobs = make_jobs(size)
+    before = peak_mb()
+    fd, path = tempfile.mkstemp(suffix="." + fmt)
+    try:
+        start = time.perf_counter()
+        with os.fdopen(fd, "wb") as out:
+            if fmt == "legacy":
+                legacy(jobs, out)
+            else:
+                JOB_EXPORT.write(fmt, jobs, out, matches)
+        elapsed = time.perf_counter() - start
+        size_mb = os.path.getsize(path) / 1e6
+    finally:
+        os.remove(path)
+    print(f"{elapsed} {peak_mb() - before} {size_mb}")
+
+
+def main():
+    sizes = [int(s) for s in (sys.argv[1] if len(sys.argv) > 1 else "10000,100000,1000000").split(",")]
+    formats = (sys.argv[2] if len(sys.argv) > 2 else "legacy,xlsx,csv,jsonl").split(",")
+    if not HAS_OPENPYXL:
+        formats = [f for f in formats if f not in ("legacy", "xlsx")]
+    print(f"{'rows':>9} {'format':>7} {'seconds':>8} {'rows/s':>9} {'extra MB':>9} {'file MB':>8}")
+    for size in sizes:
+        for fmt in formats:
+            result = subprocess.run([sys.executable, __file__, "--child", str(size), fmt],
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"{size:>9} {fmt:>7} failed: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            elapsed, extra, file_mb = (float(v) for v in result.stdout.split())
+            print(f"{size:>9} {fmt:>7} {elapsed:>8.2f} {size / elapsed:>9.0f} {extra:>9.1f} {file_mb:>8.1f}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(int(sys.argv[2]), sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,114 @@
+# benchmarks/fuzzy_search.py
+"""Compare the indexed fuzzy search against the old per-part SequenceMatcher loop.
+
+Usage: python benchmarks/fuzzy_search.py [parts] [queries]
+
+Builds a synthetic catalogue from the parts in catalogue_data.json, times
+both implementations on misspelled queries, and reports how often the top
+result score and the best suggestion score agree.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from difflib import SequenceMatcher, get_close_matches
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from search_index import FuzzyIndex  # noqa: E402
+
+WORDS = ["brake", "pad", "disc", "tyre", "chain", "sprocket", "filter", "oil", "clutch", "lever",
+         "cable", "spark", "plug", "battery", "mirror", "handlebar", "grip", "seat", "exhaust", "gasket"]
+
+
+def make_catalogue(size, seed=1):
+    rng = random.Random(seed)
+    path = os.path.join(os.path.dirname(__file__), "..", "catalogue_data.json")
+    with open(path) as f:
+        base = json.load(f)
+    categories = sorted({p["category"] for p in base}) + ["Electrical", "Body", "Engine", "Controls"]
+    parts = []
+    for i in range(size):
+        template = base[i % len(base)]
+        name = " ".join(rng.sample(WORDS, 3)).title()
+        parts.append({
+            "part_id": f"P{i + 1:05d}",
+            "name": name,
+            "category": rng.choice(categories),
+            "description": template["description"][:rng.randint(40, 400)],
+        })
+    return parts
+
+
+def misspell(word, rng):
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice("aeiourstn") + word[i + 1:]
+
+
+def legacy(parts, query):
+    """The catalogue() fallback before the fuzzy index, verbatim."""
+    all_names = [p.get("name", "") for p in parts]
+    all_categories = list(set(p.get("category", "") for p in parts))
+    close_names = get_close_matches(query, [n.lower() for n in all_names], n=5, cutoff=0.4)
+    close_cats = get_close_matches(query, [c.lower() for c in all_categories], n=3, cutoff=0.4)
+    fuzzy_matches = []
+    for p in parts:
+        name_ratio = SequenceMatcher(None, query, p.get("name", "").lower()).ratio()
+        cat_ratio = SequenceMatcher(None, query, p.get("category", "").lower()).ratio()
+        desc_ratio = SequenceMatcher(None, query, p.get("description", "").lower()).ratio()
+        best_ratio = max(name_ratio, cat_ratio, desc_ratio)
+        if best_ratio > 0.35:
+            fuzzy_matches.append((p, best_ratio))
+    fuzzy_matches.sort(key=lambda x: x[1], reverse=True)
+    return fuzzy_matches, close_names, close_cats
+
+
+def indexed(index, query):
+    return (index.search(query, cutoff=0.35),
+            index.suggest(query, "name", n=5, cutoff=0.4),
+            index.suggest(query, "category", n=3, cutoff=0.4))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    rng = random.Random(2)
+    parts = make_catalogue(size)
+    queries = [misspell(rng.choice(WORDS), rng) for _ in range(count)]
+    queries += [" ".join(misspell(w, rng) for w in rng.sample(WORDS, 2)) for _ in range(count)]
+
+    start = time.perf_counter()
+    index = FuzzyIndex("bench", ("name", "category", "description"), lambda p: p["part_id"],
+                       suggest_fields=("name", "category"))
+    index.reset(parts)
+    build = time.perf_counter() - start
+
+    timings = {"legacy": [], "indexed": []}
+    same_top = same_names = 0
+    for query in queries:
+        start = time.perf_counter()
+        old = legacy(parts, query)
+        timings["legacy"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        new = indexed(index, query)
+        timings["indexed"].append(time.perf_counter() - start)
+        old_top = old[0][0][1] if old[0] else None
+        new_top = new[0][0][1] if new[0] else None
+        same_top += old_top == new_top
+        # Ties make the exact lists order-dependent, so compare the best suggestion's score
+        best = [max((SequenceMatcher(None, query, t).ratio() for t in r[1]), default=None) for r in (old, new)]
+        same_names += best[0] == best[1]
+
+    print(f"{size} parts, {len(queries)} queries, index built in {build * 1000:.0f} ms")
+    for name, values in timings.items():
+        values.sort()
+        print(f"{name:8} mean {sum(values) / len(values) * 1000:8.2f} ms   "
+              f"p95 {values[int(len(values) * 0.95) - 1] * 1000:8.2f} ms")
+    print(f"top score agrees on {same_top}/{len(queries)}, best name suggestion on {same_names}/{len(queries)}")
+    print(f"queries over budget: {index.over_budget}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# carts.py
+"""Per-user shopping carts held in memory.
+
+Each user's cart lives in this worker's memory with its item count kept
+alongside, so the navbar badge and the orders page never touch disk and
+users never wait on each other's writes. Carts nobody has changed for
+CART_TTL seconds are dropped.
+
+With CART_SPILL=sqlite (the default) carts are also copied to a table in
+CART_SPILL_PATH (SQLITE_PATH under STORE_ENGINE=sqlite, otherwise a
+carts.db of its own), so they survive restarts and other gunicorn workers
+can pick them up whatever the storage engine. Changes reach it through the store
+group-commit writer a moment later, never inside the request. Every change
+gets a new version, which the caller keeps in the user's session: a worker
+whose copy is older than the session's version reloads the cart from the
+spill, waiting up to SPILL_WAIT for the worker that made the change to
+flush it. Sharing is best-effort: if that flush is later still, the stale
+copy is served (and a warning printed).
+"""
+
+import json
+import os
+import threading
+import time
+
+from store import SQLITE_PATH, STORE_ENGINE, STORE_FLUSH_INTERVAL, group_writer, sqlite_connection
+
+CART_TTL = float(os.environ.get("CART_TTL", 7 * 24 * 3600))
+CART_SPILL = os.environ.get("CART_SPILL", "sqlite").lower()
+CART_SPILL_PATH = os.environ.get("CART_SPILL_PATH", SQLITE_PATH if STORE_ENGINE == "sqlite" else "carts.db")
+CART_SWEEP_INTERVAL = 60
+SPILL_WAIT = max(STORE_FLUSH_INTERVAL * 4, 0.2)  # how long a reader waits for another worker's flush
+
+
+class Cart:
+    """One user's items, keyed by item name, with a running quantity total."""
+
+    __slots__ = ("items", "count", "version", "touched")
+
+    def __init__(self, items=(), version=0, touched=None):
+        self.items = {item["item_name"]: dict(item) for item in items}
+        self.count = sum(item["quantity"] for item in self.items.values())
+        self.version = version
+        self.touched = time.time() if touched is None else touched
+
+
+class CartStore:
+    """Carts keyed by owner (the user id) with TTL eviction and an optional SQLite spill."""
+
+    def __init__(self, name="carts", ttl=None, spill=None, db_path=None):
+        self.name = name
+        self.ttl = CART_TTL if ttl is None else ttl
+        self.spill = (CART_SPILL if spill is None else spill) == "sqlite"
+        self.db_path = db_path or CART_SPILL_PATH
+        self._carts = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self._schema_ready = False
+        self.reloads = 0
+        self.evictions = 0
+        self.flushes = 0
+
+    # ---------- spill ----------
+
+    @property
+    def _conn(self):
+        conn = sqlite_connection(self.db_path)
+        if not self._schema_ready:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.name} (owner TEXT PRIMARY KEY, "
+                         "items TEXT NOT NULL, version INTEGER NOT NULL, touched REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_touched ON {self.name} (touched)")
+            self._schema_ready = True
+        return conn
+
+    def _load(self, owner):
+        row = self._conn.execute(
+            f"SELECT items, version, touched FROM {self.name} WHERE owner = ?", (owner,)).fetchone()
+        if row is None:
+            return None
+        return Cart(json.loads(row[0]), row[1], row[2])
+
+    def flush(self):
+        """Write changed carts to the spill and drop expired rows; called by the group writer."""
+        with self._lock:
+            owners, self._dirty = self._dirty, set()
+            rows = []
+            for owner in owners:
+                cart = self._carts.get(owner)
+                if cart is not None:
+                    rows.append((owner, json.dumps(list(cart.items.values())), cart.version, cart.touched))
+        if not owners:
+            return
+        conn = self._conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                f"INSERT INTO {self.name} (owner, items, version, touched) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(owner) DO UPDATE SET items = excluded.items, version = excluded.version, "
+                f"touched = excluded.touched WHERE excluded.version > {self.name}.version",
+                rows,
+            )
+            conn.execute(f"DELETE FROM {self.name} WHERE touched < ?", (time.time() - self.ttl,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            with self._lock:
+                self._dirty |= owners
+            raise
+        self.flushes += 1
+
+    # ---------- memory ----------
+
+    def _sweep(self, now):
+        if now - self._last_sweep < CART_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        expired = [owner for owner, cart in self._carts.items()
+                   if now - cart.touched > self.ttl and owner not in self._dirty]
+        for owner in expired:
+            del self._carts[owner]
+        self.evictions += len(expired)
+
+    def _cart(self, owner, version):
+        """owner's cart, reloaded from the spill first if this worker's copy is
+        older than version; the caller takes self._lock to read or change it."""
+        with self._lock:
+            now = time.time()
+            self._sweep(now)
+            cart = self._carts.get(owner)
+            if cart is not None and now - cart.touched > self.ttl:
+                del self._carts[owner]
+                self.evictions += 1
+                cart = None
+            if cart is not None and (cart.version >= version or not self.spill):
+                return cart
+        # Unknown here, or changed by another worker since: read the spill without blocking other users
+        deadline = time.time() + SPILL_WAIT
+        while True:
+            stored = self._load(owner) if self.spill else None
+            if not self.spill or (stored.version if stored else 0) >= version:
+                break
+            if time.time() >= deadline:
+                print(f"Cart of {owner} not flushed by another worker within {SPILL_WAIT}s, serving an older copy")
+                break
+            time.sleep(SPILL_WAIT / 8)
+        if stored is None or time.time() - stored.touched > self.ttl:
+            stored = Cart(version=version)  # Expired or never saved: start empty
+        with self._lock:
+            self.reloads += 1
+            cart = self._carts.get(owner)
+            if cart is None or cart.version < stored.version:
+                cart = self._carts[owner] = stored
+            return cart
+
+    def _changed(self, owner, cart):
+        cart.version = max(cart.version + 1, time.time_ns())
+        cart.touched = time.time()
+        cart.count = sum(item["quantity"] for item in cart.items.values())
+        if self.spill:
+            self._dirty.add(owner)
+            group_writer.schedule(self)
+        return cart.version
+
+    # ---------- public API ----------
+
+    def items(self, owner, version=0):
+        """Copies of the items in owner's cart."""
+        cart = self._cart(owner, version)
+        with self._lock:
+            return [dict(item) for item in cart.items.values()]
+
+    def count(self, owner, version=0):
+        """Total quantity in owner's cart."""
+        return self._cart(owner, version).count
+
+    def add(self, owner, item_name, price, quantity, version=0, part_id=None):
+        """Add quantity of an item (merging with the same item); returns the cart's new version.
+
+        part_id links the line to a catalogue part for stock checks at checkout.
+        """
+        cart = self._cart(owner, version)
+        with self._lock:
+            cart = self._carts.setdefault(owner, cart)  # in case it was reloaded meanwhile
+            item = cart.items.get(item_name)
+            if item:
+                item["quantity"] += quantity
+            else:
+                item = cart.items[item_name] = {"item_name": item_name, "price": price, "quantity": quantity}
+                if part_id:
+                    item["part_id"] = part_id
+            return self._changed(owner, cart)
+
+    def set_quantity(self, owner, item_name, quantity, version=0):
+        cart = self._cart(owner, version)
+        with self._lock:
+            cart = self._carts.setdefault(owner, cart)  # in case it was reloaded meanwhile
+            if item_name in cart.items:
+                cart.items[item_name]["quantity"] = quantity
+                return self._changed(owner, cart)
+            return cart.version
+
+    def remove(self, owner, item_name, version=0):
+        cart = self._cart(owner, version)
+        with self._lock:
+            cart = self._carts.setdefault(owner, cart)  # in case it was reloaded meanwhile
+            if cart.items.pop(item_name, None) is not None:
+                return self._changed(owner, cart)
+            return cart.version
+
+    def take(self, owner, version=0):
+        """Empty owner's cart and return (its items, the new version), e.g. for checkout."""
+        cart = self._cart(owner, version)
+        with self._lock:
+            cart = self._carts.setdefault(owner, cart)  # in case it was reloaded meanwhile
+            items = list(cart.items.values())
+            cart.items = {}
+            return items, self._changed(owner, cart)
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "carts": len(self._carts), "dirty": len(self._dirty),
+                    "spill": "sqlite" if self.spill else None, "ttl": self.ttl,
+                    "reloads": self.reloads, "evictions": self.evictions, "flushes": self.flushes}
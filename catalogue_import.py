@@ -0,0 +1,131 @@
+# catalogue_import.py
+"""Streaming catalogue import for CSV and Excel supplier files.
+
+Rows are read one at a time (CSV is decoded incrementally from the upload
+stream), looked up by part_id through the store's primary-key index and
+upserted in chunks of IMPORT_CHUNK_ROWS rows, each chunk one locked write,
+so the import holds one chunk at a time however large the file or the
+catalogue. The json engine rewrites the whole file per write; for large
+imports into a large catalogue use STORE_ENGINE=journal (or sqlite), or
+STORE_DURABILITY=group so chunk writes are batched in the background.
+
+Column order: Part ID, Name, Category, Price, Stock, Description, Image.
+The first row is a header. Rows without a Part ID are skipped; rows with a
+price or stock that is not a number are rejected and reported.
+"""
+
+import csv
+import io
+import os
+
+IMPORT_CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", 500))
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportReport:
+    """Counters and per-row errors for one import."""
+
+    def __init__(self):
+        self.processed = 0
+        self.added = 0
+        self.updated = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": line, "error": message})
+
+    def summary(self):
+        return (f"Processed {self.processed} rows: added {self.added} parts, "
+                f"updated {self.updated}, rejected {self.rejected}")
+
+    def to_dict(self):
+        return {"processed": self.processed, "added": self.added, "updated": self.updated,
+                "rejected": self.rejected, "errors": list(self.errors)}
+
+
+def _cell(row, index):
+    value = row[index] if len(row) > index else None
+    return "" if value is None else str(value).strip()
+
+
+def _number(row, index, kind, label):
+    value = row[index] if len(row) > index else None
+    if value is None or value == "":
+        return kind(0)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return kind(value)
+    try:
+        return kind(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{label} {value!r} is not a number")
+
+
+def parse_part_row(row):
+    """Part fields from one import row; raises ValueError for bad numbers."""
+    return {
+        "part_id": _cell(row, 0),
+        "name": _cell(row, 1),
+        "category": _cell(row, 2),
+        "price": _number(row, 3, float, "price"),
+        "stock": _number(row, 4, int, "stock"),
+        "description": _cell(row, 5),
+        "image": _cell(row, 6),
+    }
+
+
+def csv_rows(binary_stream, encoding="utf-8-sig"):
+    """Yield CSV rows decoded incrementally from a binary upload stream."""
+    text = io.TextIOWrapper(binary_stream, encoding=encoding, newline="")
+    try:
+        yield from csv.reader(text)
+    finally:
+        # Leave the underlying upload open for its owner to close
+        text.detach()
+
+
+def import_rows(store, rows, report=None, chunk_size=None, progress=None):
+    """Upsert parts from rows (header first) into store; returns the ImportReport.
+
+    Existing parts are updated in place, keeping fields the file does not
+    carry. progress, if given, is called with the report after every chunk.
+    """
+    report = report or ImportReport()
+    chunk_size = chunk_size or IMPORT_CHUNK_ROWS
+    chunk = []
+
+    def commit():
+        with store.lock():
+            merged = {}
+            for line, part in chunk:
+                existing = merged.get(part["part_id"]) or store.get(part["part_id"])
+                if existing:
+                    report.updated += 1
+                    part = dict(existing, **part)
+                else:
+                    report.added += 1
+                merged[part["part_id"]] = part
+            store.upsert_many(merged.values())
+        chunk.clear()
+        if progress:
+            progress(report)
+
+    for line, row in enumerate(rows, 1):
+        if line == 1:  # Skip header
+            continue
+        if not row or not _cell(row, 0):  # Skip empty rows
+            continue
+        report.processed += 1
+        try:
+            part = parse_part_row(row)
+        except ValueError as e:
+            report.reject(line, str(e))
+            continue
+        chunk.append((line, part))
+        if len(chunk) >= chunk_size:
+            commit()
+    if chunk:
+        commit()
+    return report
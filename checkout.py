@@ -0,0 +1,172 @@
+# checkout.py
+"""Stock-checked checkout and short-lived stock reservations.
+
+Adding a catalogue part to a cart reserves that quantity for the cart's
+owner for RESERVATION_TTL seconds (renewed on every change to the line), so
+two customers cannot both be promised the last unit. Reservations are
+records in their own store keyed by (owner, part_id); expired ones are
+ignored when counting and deleted the next time that part is reserved.
+
+place_order() is the checkout transaction: holding the catalogue, orders
+and reservations locks it checks every cart line against stock minus other owners'
+live reservations, then writes the stock decrements and the order and drops
+the owner's reservations. If anything is short, nothing is written and
+StockError lists the shortages.
+
+With the sqlite engine the decrements and the order commit in one
+transaction. The file engines write two files, so a crash in between would
+leave stock taken with no order; place_order() first notes the checkout in
+a log store and repair_checkouts(), run at startup, puts back the stock of
+any logged checkout whose order was never written.
+"""
+
+import os
+import time
+from collections import Counter
+
+from store import thaw, upsert_together, writes_together
+
+RESERVATION_TTL = float(os.environ.get("RESERVATION_TTL", 15 * 60))
+
+
+class StockError(ValueError):
+    """Raised when parts do not have enough unreserved stock; shortages are (name, wanted, available)."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__("; ".join(f"{name}: wanted {wanted}, {available} available"
+                                   for name, wanted, available in shortages))
+
+
+def check_quantity(quantity):
+    """Raise ValueError unless quantity is a whole number of at least 1."""
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+        raise ValueError(f"quantity must be a whole number of at least 1, not {quantity!r}")
+
+
+class StockReservations:
+    """Per-owner holds on catalogue stock that expire after ttl seconds."""
+
+    def __init__(self, store, catalogue, ttl=None):
+        self.store = store
+        self.catalogue = catalogue
+        self.ttl = RESERVATION_TTL if ttl is None else ttl
+
+    def held(self, part_id, exclude_owner=None, now=None):
+        """Units of part_id reserved by live holds of owners other than exclude_owner."""
+        now = time.time() if now is None else now
+        return sum(r["quantity"] for r in self.store.find("part_id", part_id)
+                   if r["expires"] > now and r["owner"] != exclude_owner)
+
+    def available(self, part, owner=None):
+        """Stock of part that owner could still take."""
+        return part.get("stock", 0) - self.held(part["part_id"], exclude_owner=owner)
+
+    def reserve(self, owner, part, quantity):
+        """Hold quantity units of part for owner (replacing any earlier hold); raises StockError.
+
+        Stock is reread under the catalogue lock, and holds are counted under
+        the reservations lock, the order place_order() takes them in, so a
+        checkout cannot run between the check and the hold.
+        """
+        check_quantity(quantity)
+        now = time.time()
+        with self.catalogue.lock(), self.store.lock():
+            part = self.catalogue.get(part["part_id"]) or dict(part, stock=0)
+            expired = [(r["owner"], r["part_id"]) for r in self.store.find("part_id", part["part_id"])
+                       if r["expires"] <= now]
+            for key in expired:
+                self.store.delete(key)
+            available = part.get("stock", 0) - self.held(part["part_id"], exclude_owner=owner, now=now)
+            if quantity > available:
+                raise StockError([(part["name"], quantity, max(available, 0))])
+            self.store.upsert({"owner": owner, "part_id": part["part_id"],
+                               "quantity": quantity, "expires": now + self.ttl})
+
+    def release(self, owner, part_ids):
+        """Drop owner's holds on part_ids."""
+        with self.store.lock():
+            for part_id in part_ids:
+                self.store.delete((owner, part_id))
+
+
+def place_order(catalogue, orders, reservations, owner, cart, make_order, log=None):
+    """Check and decrement stock for every cart line and write make_order(); returns the order.
+
+    Cart lines with a part_id are stock-checked; others (free-text items)
+    are ordered as they are. Raises StockError without writing anything
+    when a part is short, and ValueError when a line's quantity is not a
+    whole number of at least 1. log is the store repair_checkouts() reads,
+    used when the two writes cannot share a transaction.
+    """
+    wanted = Counter()
+    for item in cart:
+        check_quantity(item["quantity"])
+        if item.get("part_id"):
+            wanted[item["part_id"]] += item["quantity"]
+
+    # Same lock order as StockReservations.reserve(): catalogue, then reservations
+    with catalogue.lock(), orders.lock(), reservations.store.lock():
+        parts = {}
+        shortages = []
+        for part_id, quantity in wanted.items():
+            part = catalogue.get(part_id)
+            if part is None:
+                continue  # No longer in the catalogue: nothing to decrement
+            parts[part_id] = part
+            available = reservations.available(part, owner)
+            if quantity > available:
+                shortages.append((part["name"], quantity, max(available, 0)))
+        if shortages:
+            raise StockError(shortages)
+
+        order = make_order()
+        taken = [dict(thaw(part), stock=part.get("stock", 0) - wanted[part_id]) for part_id, part in parts.items()]
+        if writes_together(catalogue, orders) or not taken:
+            upsert_together([(catalogue, taken), (orders, [order])])
+        else:
+            key = orders.key_of(order)
+            if log is not None:
+                log.upsert({"order_id": key, "stock": {part["part_id"]: [parts[part["part_id"]].get("stock", 0),
+                                                                     part["stock"]] for part in taken}})
+            catalogue.upsert_many(taken)
+            try:
+                orders.upsert(order)
+            except Exception:
+                catalogue.upsert_many(parts.values())  # Put the stock back
+                if log is not None:
+                    log.delete(key)
+                raise
+            if log is not None:
+                log.delete(key)
+        reservations.release(owner, list(wanted))
+    return order
+
+
+def repair_checkouts(catalogue, orders, log):
+    """Finish what place_order() logged but did not complete; returns how many were repaired.
+
+    A log entry only outlives its checkout when the process died between the
+    stock and order writes, so under the same locks every entry left is one
+    of those. If its order was written there is nothing to undo; otherwise
+    each part whose stock still has the decremented value gets the old value
+    back, and a part changed since is reported for staff to check.
+    """
+    repaired = 0
+    with catalogue.lock(), orders.lock(), log.lock():
+        for entry in log.snapshot():
+            if orders.get(entry["order_id"]) is None:
+                restored = []
+                for part_id, (before, after) in entry["stock"].items():
+                    part = catalogue.get(part_id)
+                    if part is None or part.get("stock") == before:
+                        continue  # Gone, or the decrement was never written
+                    if part.get("stock") == after:
+                        restored.append(dict(thaw(part), stock=before))
+                    else:
+                        print(f"Checkout {entry['order_id']} did not finish and stock of {part_id} has changed "
+                              f"since; check it by hand (was {before}, then {after}, now {part.get('stock')})")
+                catalogue.upsert_many(restored)
+                repaired += 1
+            log.delete(entry["order_id"])
+    return repaired
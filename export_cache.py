@@ -0,0 +1,127 @@
+# export_cache.py
+"""On-disk cache of generated export files.
+
+A file is keyed by (export name, format, normalized filter, data version),
+where the version is the store's durable_version(), the same for every
+worker reading the same data. As long as nothing is written, a repeated
+export is a plain file send; after a write the key changes and the old file
+is never asked for again, so it just ages out. Files are touched on every
+hit and the least recently used are removed once the directory holds more
+than EXPORT_CACHE_MAX_BYTES.
+
+A miss either builds the file before it is sent (fetch(), for XLSX) or
+copies a streamed export into it as the chunks go out (tee(), for CSV and
+JSON Lines); either way the file only appears under its key once complete.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR", "export_cache")
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+class ExportCache:
+    """Generated files in a directory, named by a hash of their key, evicted LRU by total size."""
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or EXPORT_CACHE_DIR
+        self.max_bytes = EXPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key, extension):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest + extension)
+
+    def get(self, key, extension):
+        """Path of the cached file for key, or None if there is none yet."""
+        path = self._path(key, extension)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def _temp_file(self, extension):
+        with self._lock:
+            self.misses += 1
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=extension)
+
+    def fetch(self, key, extension, build):
+        """Path of the cached file for key, calling build(path) to write it on a miss."""
+        path = self.get(key, extension)
+        if path is not None:
+            return path
+        path = self._path(key, extension)
+        fd, tmp_path = self._temp_file(extension)
+        os.close(fd)
+        try:
+            build(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._evict(keep=path)
+        return path
+
+    def tee(self, key, extension, chunks):
+        """Yield chunks while writing them to the file for key. The file is
+        kept only if every chunk was written; a client that disconnects
+        part way leaves nothing behind."""
+        path = self._path(key, extension)
+        fd, tmp_path = self._temp_file(extension)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._evict(keep=path)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith(".tmp-"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+        return entries
+
+    def _evict(self, keep):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue  # gone already, or still open for sending on Windows
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        entries = self._entries() if os.path.isdir(self.directory) else []
+        total = self.hits + self.misses
+        return {"files": len(entries), "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else None}
@@ -0,0 +1,217 @@
+# exports.py
+"""Streaming file exports.
+
+Exports are generators of bytes chunks that Flask sends as a streamed
+response, so the first bytes leave as soon as the first rows are
+formatted and memory use stays at one chunk however large the export is.
+Rows are buffered into chunks of about EXPORT_CHUNK_BYTES to keep the
+per-write overhead low, and can be gzip-compressed on the fly.
+
+Export describes one tabular export (sheet title, headers, column widths
+and a function turning a record into a row) and writes it as CSV, JSON
+Lines or XLSX. XLSX uses openpyxl's write-only mode, which streams rows to
+a temporary file instead of building the workbook in memory; because the
+zip container is only complete at the end, it is written to disk first and
+then sent from there. Filters are plain predicates applied lazily while
+the records stream through.
+"""
+
+import csv
+import io
+import json
+import os
+import tempfile
+import zlib
+
+from flask import Response, send_file, stream_with_context
+
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+EXPORT_CHUNK_BYTES = int(os.environ.get("EXPORT_CHUNK_BYTES", 64 * 1024))
+EXPORT_GZIP_MIN_ROWS = int(os.environ.get("EXPORT_GZIP_MIN_ROWS", 1000))
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+    "csv": ("text/csv", ".csv"),
+    "jsonl": ("application/x-ndjson", ".jsonl"),
+}
+HEADER_COLOR = "FF6A3D"
+
+
+def csv_chunks(headers, rows, encoding="utf-8"):
+    """Yield the CSV encoding of headers plus rows in chunks of about EXPORT_CHUNK_BYTES."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode(encoding)
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode(encoding)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of bytes chunks into a gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def wants_gzip(request, row_count):
+    """Compress when the client accepts gzip and the export is large enough to be worth it."""
+    if "gzip" not in request.accept_encodings:
+        return False
+    forced = request.args.get("gzip")
+    if forced is not None:
+        return forced not in ("0", "false", "no")
+    return row_count >= EXPORT_GZIP_MIN_ROWS
+
+
+def jsonl_chunks(headers, rows, encoding="utf-8"):
+    """Yield one JSON object per row, keyed by headers, in chunks of about EXPORT_CHUNK_BYTES."""
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(headers, row)), ensure_ascii=False) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(lines).encode(encoding)
+            lines = []
+            size = 0
+    if lines:
+        yield "".join(lines).encode(encoding)
+
+
+class Export:
+    """A tabular export: sheet title, (header, column width) pairs and a record -> row function."""
+
+    def __init__(self, name, title, columns, row_of):
+        self.name = name
+        self.title = title
+        self.headers = [header for header, _ in columns]
+        self.widths = [width for _, width in columns]
+        self.row_of = row_of
+
+    def rows(self, records, predicate=None):
+        for record in records:
+            if predicate is None or predicate(record):
+                yield self.row_of(record)
+
+    def chunks(self, fmt, records, predicate=None):
+        """Bytes chunks of a CSV or JSON Lines export."""
+        if fmt == "csv":
+            return csv_chunks(self.headers, self.rows(records, predicate))
+        if fmt == "jsonl":
+            return jsonl_chunks(self.headers, self.rows(records, predicate))
+        raise ValueError(f"{fmt} exports are not streamable")
+
+    def write_xlsx(self, records, target, predicate=None):
+        """Write an XLSX workbook to target (path or binary file) in write-only mode."""
+        from openpyxl.utils import get_column_letter
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(self.title)
+        for index, width in enumerate(self.widths, 1):
+            ws.column_dimensions[get_column_letter(index)].width = width
+
+        header_fill = PatternFill(start_color=HEADER_COLOR, end_color=HEADER_COLOR, fill_type="solid")
+        header_font = Font(bold=True, color="FFFFFF")
+        header = []
+        for value in self.headers:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.fill = header_fill
+            cell.font = header_font
+            header.append(cell)
+        ws.append(header)
+
+        for row in self.rows(records, predicate):
+            ws.append(row)
+        wb.save(target)
+
+    def write(self, fmt, records, target, predicate=None):
+        """Write the export in any format to an open binary file or a path."""
+        if fmt == "xlsx":
+            self.write_xlsx(records, target, predicate)
+            return
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, "wb") as f:
+                self.write(fmt, records, f, predicate)
+            return
+        for chunk in self.chunks(fmt, records, predicate):
+            target.write(chunk)
+
+
+class TempFileBody:
+    """Response body reading a temporary file in chunks and deleting it when the response closes.
+
+    send_file() responses skip call_on_close hooks, so the cleanup lives in
+    the body's own close(), which the WSGI server always calls.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+
+    def __iter__(self):
+        return iter(lambda: self.file.read(EXPORT_CHUNK_BYTES), b"")
+
+    def close(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def export_response(export, fmt, records, predicate, download_stem, cache=None, cache_key=None):
+    """Send an export as a download: CSV/JSONL streamed, XLSX built in a temp file then sent.
+
+    With an ExportCache and a cache_key (normalized filter plus data version)
+    a repeat is sent from the cached file. On a miss CSV/JSONL still stream,
+    copied into the cache on the way out, and XLSX is built into the cache.
+    """
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    download_name = download_stem + extension
+    chunks = None
+    if cache is not None and cache_key is not None:
+        key = (export.name, fmt) + tuple(cache_key)
+        path = cache.get(key, extension)
+        if path is None and fmt == "xlsx":
+            path = cache.fetch(key, extension, lambda path: export.write_xlsx(records, path, predicate))
+        if path is not None:
+            return send_file(path, as_attachment=True, download_name=download_name, mimetype=mimetype)
+        chunks = cache.tee(key, extension, export.chunks(fmt, records, predicate))
+    if fmt != "xlsx":
+        if chunks is None:
+            chunks = export.chunks(fmt, records, predicate)
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={download_name}"},
+        )
+    fd, path = tempfile.mkstemp(prefix=f"{export.name}-", suffix=extension)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            export.write_xlsx(records, f, predicate)
+        body = TempFileBody(path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename={download_name}",
+        "Content-Length": str(os.path.getsize(path)),
+    })
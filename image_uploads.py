@@ -0,0 +1,200 @@
+# image_uploads.py
+"""Content-addressed catalogue image uploads.
+
+save_image_upload() streams an uploaded file to disk in chunks while
+hashing it, checks its magic bytes rather than trusting the filename, and
+stores it as <sha256 prefix>.<ext>, so the same picture uploaded twice
+(or for two parts) is kept once. When Pillow is installed it also writes
+a thumbnail and WebP versions next to the original at upload time:
+
+    <hash>.<ext>          original
+    <hash>.thumb.<ext>    at most IMAGE_THUMB_SIZE pixels on its longest side
+    <hash>.webp           full size WebP
+    <hash>.thumb.webp     thumbnail WebP
+
+image_set() maps a stored image URL to the variants that exist, falling
+back to the original for images uploaded before this pipeline or without
+Pillow.
+
+Because a stored file's name is derived from its content, its URL is a
+fingerprint: is_fingerprinted() names files that can be cached forever,
+and orphaned_uploads() finds files no record points at any more.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+IMAGE_THUMB_SIZE = int(os.environ.get("IMAGE_THUMB_SIZE", 480))
+IMAGE_WEBP_QUALITY = int(os.environ.get("IMAGE_WEBP_QUALITY", 80))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+HASH_LENGTH = 20
+
+# Leading bytes -> stored extension; WebP also needs "WEBP" at offset 8
+MAGIC_TYPES = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"RIFF", "webp"),
+]
+PIL_FORMATS = {"jpg": "JPEG", "png": "PNG", "webp": "WEBP"}
+FINGERPRINTED_NAME = re.compile(rf"[0-9a-f]{{{HASH_LENGTH}}}(\.thumb)?\.(jpg|png|gif|webp)")
+
+
+def sniff_image_type(head):
+    """Extension for the image format head starts with, or None."""
+    for magic, ext in MAGIC_TYPES:
+        if head.startswith(magic):
+            if ext == "webp" and head[8:12] != b"WEBP":
+                return None
+            return ext
+    return None
+
+
+def _variant_names(digest, ext):
+    names = {"thumb": f"{digest}.thumb.{ext}", "thumb_webp": f"{digest}.thumb.webp"}
+    if ext != "webp":
+        names["webp"] = f"{digest}.webp"
+    return names
+
+
+def is_fingerprinted(filename):
+    """Whether filename is a content-addressed image or variant, whose bytes never change."""
+    return FINGERPRINTED_NAME.fullmatch(os.path.basename(filename)) is not None
+
+
+def save_image_upload(file, folder, url_prefix="/static/uploads"):
+    """Store an uploaded image content-addressed in folder and return its URL.
+
+    Raises ValueError when the upload is not a JPEG, PNG, GIF or WebP image.
+    """
+    return store_image_stream(file.stream, folder, url_prefix)
+
+
+def store_image_stream(stream, folder, url_prefix="/static/uploads"):
+    """Copy an image from a binary stream into folder content-addressed; returns its URL."""
+    head = stream.read(UPLOAD_CHUNK_BYTES)
+    ext = sniff_image_type(head)
+    if ext is None:
+        raise ValueError("not a JPEG, PNG, GIF or WebP image")
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".upload-")
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            chunk = head
+            while chunk:
+                out.write(chunk)
+                digest.update(chunk)
+                chunk = stream.read(UPLOAD_CHUNK_BYTES)
+        name = digest.hexdigest()[:HASH_LENGTH]
+        path = os.path.join(folder, f"{name}.{ext}")
+        if os.path.exists(path):
+            os.remove(tmp_path)  # Already stored: deduplicated
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    make_variants(path)
+    return f"{url_prefix}/{name}.{ext}"
+
+
+def make_variants(path):
+    """Write the thumbnail and WebP variants of the image at path that are missing."""
+    if not HAS_PIL:
+        return
+    folder, filename = os.path.split(path)
+    digest, ext = filename.split(".", 1)
+    if ext not in PIL_FORMATS:
+        return  # GIFs may be animated; serve them as uploaded
+    targets = {kind: os.path.join(folder, name) for kind, name in _variant_names(digest, ext).items()}
+    if all(os.path.exists(target) for target in targets.values()):
+        return
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            if ext == "jpg" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            thumb = image.copy()
+            thumb.thumbnail((IMAGE_THUMB_SIZE, IMAGE_THUMB_SIZE))
+            outputs = {"thumb": (thumb, PIL_FORMATS[ext]), "thumb_webp": (thumb, "WEBP"),
+                       "webp": (image, "WEBP")}
+            for kind, target in targets.items():
+                if os.path.exists(target):
+                    continue
+                picture, fmt = outputs[kind]
+                options = {"quality": IMAGE_WEBP_QUALITY} if fmt == "WEBP" else {"optimize": True}
+                fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".variant-")
+                try:
+                    with os.fdopen(fd, "wb") as out:
+                        picture.save(out, fmt, **options)
+                    os.replace(tmp_path, target)
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+    except Exception as e:
+        # The original is stored; pages fall back to it when a variant is missing
+        print(f"Error creating image variants for {filename}: {e}")
+
+
+_known_variants = set()
+
+
+def image_set(url, folder, url_prefix="/static/uploads"):
+    """URLs to use for a stored image: {"full", "full_webp", "thumb", "thumb_webp"}.
+
+    Missing variants fall back to the original (or None for the WebP ones),
+    so legacy uploads keep working.
+    """
+    result = {"full": url, "full_webp": None, "thumb": url, "thumb_webp": None}
+    if not url or not url.startswith(url_prefix + "/"):
+        return result
+    digest, _, ext = url[len(url_prefix) + 1:].partition(".")
+    if len(digest) != HASH_LENGTH or ext not in PIL_FORMATS:
+        return result
+    if ext == "webp":
+        result["full_webp"] = url
+    for kind, name in _variant_names(digest, ext).items():
+        variant = f"{url_prefix}/{name}"
+        if variant not in _known_variants:
+            if not os.path.exists(os.path.join(folder, name)):
+                continue
+            _known_variants.add(variant)
+        result["full_webp" if kind == "webp" else kind] = variant
+    return result
+
+
+def orphaned_uploads(folder, referenced, url_prefix="/static/uploads", min_age=3600):
+    """Paths of files under folder whose URL is not in referenced, variants
+    included, skipping files younger than min_age seconds (an upload whose
+    record has not been saved yet)."""
+    keep = set()
+    for url in referenced:
+        if url:
+            keep.update(u for u in image_set(url, folder, url_prefix).values() if u)
+    cutoff = time.time() - min_age
+    orphans = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            url = url_prefix + "/" + os.path.relpath(path, folder).replace(os.sep, "/")
+            if url in keep:
+                continue
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+            except OSError:
+                continue
+            orphans.append(path)
+    return sorted(orphans)
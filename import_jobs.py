@@ -0,0 +1,137 @@
+# import_jobs.py
+"""Background catalogue imports with pollable status.
+
+start_import_job() spools the upload to IMPORT_JOBS_DIR, returns a job id
+straight away and runs the import on a daemon thread, so a large supplier
+file neither holds a gunicorn worker past its timeout nor sits in memory.
+Excel files are opened with openpyxl's read-only streaming mode and CSV
+files are decoded incrementally; both go through catalogue_import's
+chunked importer.
+
+Job status lives in <IMPORT_JOBS_DIR>/<id>.json and is rewritten after each
+chunk, so any worker can answer a poll for it.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from catalogue_import import ImportReport, import_rows, csv_rows
+from store import atomic_write_json
+
+try:
+    from openpyxl import load_workbook
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+IMPORT_JOBS_DIR = os.environ.get("IMPORT_JOBS_DIR", "import_jobs")
+JOB_STALE_SECONDS = 600       # a running job silent this long died with its worker
+JOB_KEEP_SECONDS = 24 * 3600  # finished job statuses are pruned after a day
+
+
+def _status_path(job_id):
+    return os.path.join(IMPORT_JOBS_DIR, f"{job_id}.json")
+
+
+def _write_status(job):
+    job["updated"] = time.time()
+    atomic_write_json(_status_path(job["id"]), job)
+
+
+def read_job(job_id):
+    """Status dict for job_id, or None if there is no such job."""
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_status_path(job_id)) as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if job["state"] in ("queued", "running") and time.time() - job["updated"] > JOB_STALE_SECONDS:
+        job["state"] = "interrupted"
+    return job
+
+
+def _prune():
+    now = time.time()
+    for name in os.listdir(IMPORT_JOBS_DIR):
+        path = os.path.join(IMPORT_JOBS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > JOB_KEEP_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def start_import_job(store, upload, filename):
+    """Spool upload to disk and import it into store in the background; returns the job id."""
+    os.makedirs(IMPORT_JOBS_DIR, exist_ok=True)
+    _prune()
+    job_id = uuid.uuid4().hex[:12]
+    kind = "xlsx" if filename.lower().endswith((".xlsx", ".xls")) else "csv"
+    # openpyxl picks its reader from the extension, so keep it on the spooled copy
+    path = os.path.join(IMPORT_JOBS_DIR, f"{job_id}.upload.{kind}")
+    upload.save(path)
+    job = {
+        "id": job_id,
+        "filename": filename,
+        "kind": kind,
+        "state": "queued",
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "bytes_total": os.path.getsize(path),
+        "bytes_read": 0,
+        "rows_total": None,
+        "report": ImportReport().to_dict(),
+        "error": None,
+    }
+    _write_status(job)
+    threading.Thread(target=_run, args=(job, store, path), name=f"import-{job_id}", daemon=True).start()
+    return job_id
+
+
+def _run(job, store, path):
+    report = ImportReport()
+    job["state"] = "running"
+    _write_status(job)
+    try:
+        if job["kind"] == "xlsx":
+            if not HAS_OPENPYXL:
+                raise RuntimeError("openpyxl is not installed")
+            workbook = load_workbook(path, read_only=True, data_only=True)
+            try:
+                worksheet = workbook.active
+                job["rows_total"] = worksheet.max_row
+
+                def progress(report):
+                    job["report"] = report.to_dict()
+                    _write_status(job)
+
+                import_rows(store, worksheet.iter_rows(values_only=True), report, progress=progress)
+            finally:
+                workbook.close()
+        else:
+            with open(path, "rb") as f:
+                def progress(report):
+                    job["report"] = report.to_dict()
+                    job["bytes_read"] = f.tell()
+                    _write_status(job)
+
+                import_rows(store, csv_rows(f), report, progress=progress)
+            job["bytes_read"] = job["bytes_total"]
+        job["state"] = "done"
+    except Exception as e:
+        print(f"Error in import job {job['id']}: {e}")
+        job["state"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["report"] = report.to_dict()
+        job["finished"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        _write_status(job)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
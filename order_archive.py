@@ -0,0 +1,222 @@
+# order_archive.py
+"""Cold storage for orders that are finished with.
+
+SegmentArchive.write() stores records as gzip-compressed JSON Lines
+segments, one per month of the record's date and archive run:
+
+    order_archive/
+        manifest.json
+        2025-11/orders-20260301T020000-3f9c1a.jsonl.gz
+        2025-12/orders-20260301T020000-3f9c1a.jsonl.gz
+
+Segments are written once and never changed. manifest.json lists each
+with its month, row count and date range, so readers open only the months
+they need. page() has the same cursor contract as KeysetIndex.page(), so a
+listing can merge archived rows with the store's; records read back carry
+archived=True. The store itself keeps only active orders and nothing reads
+the archive unless a page or export asks for archived orders.
+
+A run writes its segments and the manifest before the caller deletes the
+records from the store. If it is interrupted in between, the records are in
+both places and are archived again by the next run; readers keep one copy
+of a key per month, the newest segment's.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from store import FileLock, atomic_write_json, freeze
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "order_archive")
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_MAX_AGE_DAYS = float(os.environ.get("ARCHIVE_MAX_AGE_DAYS", 0))
+ARCHIVE_STATUSES = tuple(s.strip() for s in os.environ.get("ARCHIVE_STATUSES", "Completed,Cancelled").split(",")
+                         if s.strip())
+ARCHIVE_CACHE_MONTHS = int(os.environ.get("ARCHIVE_CACHE_MONTHS", 12))
+UNDATED = "0000-00"  # partition for records without a date; sorts before every month
+
+
+def month_of(date):
+    """The YYYY-MM partition a date string falls in."""
+    return date[:7] if len(date) >= 7 else UNDATED
+
+
+def archivable(order, now, after_days=None, max_age_days=None, statuses=None):
+    """Whether an order (date "YYYY-MM-DD HH:MM:SS") should move to the archive:
+    in a final status and older than after_days, or older than max_age_days
+    whatever its status (0 turns that off)."""
+    after_days = ARCHIVE_AFTER_DAYS if after_days is None else after_days
+    max_age_days = ARCHIVE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    statuses = ARCHIVE_STATUSES if statuses is None else statuses
+    try:
+        placed = time.mktime(time.strptime(order.get("date", ""), "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        return False  # Undated orders stay where staff can see them
+    age_days = (now - placed) / 86400
+    if order.get("status") in statuses and age_days >= after_days:
+        return True
+    return max_age_days > 0 and age_days >= max_age_days
+
+
+class SegmentArchive:
+    """Records in immutable month-partitioned gzip segments listed in a manifest."""
+
+    def __init__(self, directory=None, name="orders", key_of=None, date_of=None):
+        self.directory = directory or ARCHIVE_DIR
+        self.name = name
+        self.key_of = key_of or (lambda record: record.get("order_id"))
+        self.date_of = date_of or (lambda record: record.get("date") or "")
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+        self._file_lock = FileLock(self.manifest_path + ".lock")
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._signature = None
+        self._months = OrderedDict()  # (month, segment files) -> entries, least recently used first
+        self.segment_reads = 0
+
+    # ---------- manifest ----------
+
+    def _manifest_signature(self):
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def manifest(self):
+        """The manifest, reread only when another process has changed it."""
+        with self._lock:
+            signature = self._manifest_signature()
+            if self._manifest is None or signature != self._signature:
+                if signature is None:
+                    self._manifest = {"segments": []}
+                else:
+                    with open(self.manifest_path) as f:
+                        self._manifest = json.load(f)
+                self._signature = signature
+            return self._manifest
+
+    def version(self):
+        """Token that changes whenever segments are added."""
+        self.manifest()
+        return self._signature
+
+    def months(self):
+        """Months that have segments, oldest first."""
+        return sorted({segment["month"] for segment in self.manifest()["segments"]})
+
+    # ---------- writing ----------
+
+    def _write_segment(self, month, records, run):
+        folder = os.path.join(self.directory, month)
+        os.makedirs(folder, exist_ok=True)
+        filename = f"{month}/{self.name}-{run}.jsonl.gz"
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".segment-")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as out:
+                for record in records:
+                    out.write(json.dumps(record).encode() + b"\n")
+            os.replace(tmp_path, os.path.join(self.directory, filename))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        dates = [self.date_of(r) for r in records]
+        return {"file": filename, "month": month, "count": len(records),
+                "first": min(dates), "last": max(dates),
+                "bytes": os.path.getsize(os.path.join(self.directory, filename))}
+
+    def write(self, records):
+        """Store records in new segments, one per month, and list them in the
+        manifest; returns the new manifest entries."""
+        by_month = {}
+        for record in records:
+            by_month.setdefault(month_of(self.date_of(record)), []).append(record)
+        if not by_month:
+            return []
+        run = time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        entries = []
+        for month, month_records in sorted(by_month.items()):
+            month_records.sort(key=lambda r: (self.date_of(r), self.key_of(r)))
+            entries.append(self._write_segment(month, month_records, run))
+        with self._file_lock:
+            manifest = dict(self.manifest())
+            manifest["segments"] = list(manifest["segments"]) + entries
+            os.makedirs(self.directory, exist_ok=True)
+            atomic_write_json(self.manifest_path, manifest)
+        return entries
+
+    # ---------- reading ----------
+
+    def _month(self, month):
+        """(date, key) entries and records of one month, oldest first, one per key."""
+        files = tuple(s["file"] for s in self.manifest()["segments"] if s["month"] == month)
+        with self._lock:
+            cached = self._months.get((month, files))
+            if cached is not None:
+                self._months.move_to_end((month, files))
+                return cached
+        latest = {}
+        for filename in files:  # Manifest order: a later segment's copy wins
+            self.segment_reads += 1
+            with gzip.open(os.path.join(self.directory, filename), "rt") as f:
+                for line in f:
+                    record = json.loads(line)
+                    record["archived"] = True
+                    latest[self.key_of(record)] = freeze(record)
+        entries = sorted(((self.date_of(r), key), r) for key, r in latest.items())
+        with self._lock:
+            self._months[(month, files)] = entries
+            while len(self._months) > ARCHIVE_CACHE_MONTHS:
+                self._months.popitem(last=False)
+        return entries
+
+    def page(self, after=None, before=None, limit=25, reverse=True, match=None):
+        """Up to limit archived records past a cursor, like KeysetIndex.page();
+        returns (records, has_more). Only months the walk reaches are read."""
+        descending = reverse if before is None else not reverse
+        cursor = tuple(before if before is not None else after) if (after or before) else None
+        months = self.months()
+        if cursor is not None:
+            cursor_month = month_of(cursor[0])
+            months = [m for m in months if (m <= cursor_month if descending else m >= cursor_month)]
+        if descending:
+            months.reverse()
+
+        result = []
+        for month in months:
+            entries = self._month(month)
+            for entry, record in (reversed(entries) if descending else entries):
+                if cursor is not None and (entry >= cursor if descending else entry <= cursor):
+                    continue
+                if match is None or match(record):
+                    result.append(record)
+                    if len(result) > limit:
+                        break
+            if len(result) > limit:
+                break
+        has_more = len(result) > limit
+        result = result[:limit]
+        if before is not None:
+            result.reverse()
+        return result, has_more
+
+    def records(self, match=None):
+        """Every archived record passing match, newest first, a month at a time."""
+        for month in reversed(self.months()):
+            for _, record in reversed(self._month(month)):
+                if match is None or match(record):
+                    yield record
+
+    def stats(self):
+        segments = self.manifest()["segments"]
+        return {"directory": self.directory, "segments": len(segments),
+                "records": sum(s["count"] for s in segments), "bytes": sum(s["bytes"] for s in segments),
+                "months": len({s["month"] for s in segments}), "cached_months": len(self._months),
+                "segment_reads": self.segment_reads}
@@ -0,0 +1,53 @@
+# query_cache.py
+"""Bounded LRU cache for computed listing results.
+
+Keys are expected to end with the version of every store the result was
+computed from (store.version()), so a write anywhere simply makes the old
+entries unreachable and the LRU ages them out; nothing has to be purged.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 256))
+
+
+class QueryCache:
+    """Thread-safe LRU mapping of query keys to results."""
+
+    def __init__(self, name, maxsize=None):
+        self.name = name
+        self.maxsize = QUERY_CACHE_SIZE if maxsize is None else maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, key, compute):
+        """Return the result stored under key, calling compute() on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        # Compute outside the lock; two racing misses just store the same result
+        value = compute()
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"name": self.name, "size": len(self._entries), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None}
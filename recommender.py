@@ -0,0 +1,106 @@
+# recommender.py
+"""Co-purchase recommendations mined from orders and job cards.
+
+Every order's items and every job card's parts_used form a basket. The
+CoPurchaseIndex keeps a sparse co-occurrence matrix (item -> Counter of
+items seen in the same basket) and, per item, its top-K neighbours, which
+are recomputed lazily only for the rows a write touched. Items are tokens
+such as "name:Brake Pad" (orders store names) or "id:P012" (job cards store
+part ids); the caller maps them to catalogue parts.
+
+Each basket source is attached as a store listener via source(), so a
+checkout, order edit or job card update adjusts the matrix by delta.
+"""
+
+import heapq
+import threading
+from collections import Counter
+
+TOP_K = 10
+
+
+class BasketSource:
+    """Store listener feeding one store's records into a CoPurchaseIndex."""
+
+    def __init__(self, index, name, key_of, basket_of):
+        self.index = index
+        self.name = name
+        self.key_of = key_of
+        self.basket_of = basket_of
+        self._baskets = {}
+
+    def reset(self, records):
+        with self.index._lock:
+            for basket in self._baskets.values():
+                self.index._count(basket, -1)
+            self._baskets = {}
+            for record in records:
+                self.apply(None, record)
+
+    def apply(self, old, new):
+        with self.index._lock:
+            if old is not None:
+                self.index._count(self._baskets.pop(self.key_of(old), frozenset()), -1)
+            if new is not None:
+                basket = frozenset(self.basket_of(new))
+                self._baskets[self.key_of(new)] = basket
+                self.index._count(basket, +1)
+
+
+class CoPurchaseIndex:
+    """Sparse item co-occurrence counts with cached top-K neighbours."""
+
+    def __init__(self, top_k=TOP_K):
+        self.top_k = top_k
+        self._lock = threading.RLock()
+        self._pairs = {}
+        self._freq = Counter()
+        self._top = {}
+        self.sources = []
+
+    def source(self, name, key_of, basket_of):
+        """A listener to register on a store whose records yield baskets."""
+        source = BasketSource(self, name, key_of, basket_of)
+        self.sources.append(source)
+        return source
+
+    def _count(self, basket, sign):
+        for item in basket:
+            self._freq[item] += sign
+            if self._freq[item] <= 0:
+                del self._freq[item]
+            row = self._pairs.setdefault(item, Counter())
+            for other in basket:
+                if other != item:
+                    row[other] += sign
+                    if row[other] <= 0:
+                        del row[other]
+            if not row:
+                del self._pairs[item]
+            self._top.pop(item, None)
+
+    def neighbours(self, item):
+        """The top-K items bought together with item, as (item, count) pairs."""
+        with self._lock:
+            top = self._top.get(item)
+            if top is None:
+                row = self._pairs.get(item, {})
+                top = self._top[item] = heapq.nlargest(
+                    self.top_k, row.items(), key=lambda pair: (pair[1], self._freq[pair[0]]))
+            return top
+
+    def recommend(self, items, n=None):
+        """Items most often bought with any of items, best first, excluding items themselves."""
+        items = set(items)
+        scores = Counter()
+        for item in items:
+            for other, count in self.neighbours(item):
+                if other not in items:
+                    scores[other] += count
+        ranked = sorted(scores, key=lambda other: (-scores[other], -self._freq[other], other))
+        return ranked if n is None else ranked[:n]
+
+    def stats(self):
+        return {"items": len(self._freq), "pairs": sum(len(row) for row in self._pairs.values()) // 2,
+                "cached_rows": len(self._top), "top_k": self.top_k,
+                "baskets": {s.name: len(s._baskets) for s in self.sources}}
@@ -0,0 +1,390 @@
+# search_index.py
+"""Character n-gram inverted index for substring search over store records.
+
+NgramIndex is a store listener (see store.add_listener): it maps every 1-,
+2- and 3-character substring of the indexed fields to the keys of the
+records containing it. A query of up to three characters is answered
+straight from its posting set; a longer query intersects the postings of
+its trigrams, smallest first, and checks the few surviving candidates with
+a plain substring test. Either way the result is exactly what
+`query in field.lower()` over every record would return, at a cost that
+follows the size of the posting sets rather than the catalogue.
+
+The postings are written next to the data file (<name>.ngrams.json) with a
+stamp of the indexed text, so a restart with an unchanged catalogue loads
+them instead of re-tokenising every description. The first mutation after a
+save queues one save on the store's group writer, delayed by a timer until
+NGRAM_SAVE_INTERVAL seconds after the previous one (and it is saved at
+exit), so a bulk import does not rewrite the index per chunk.
+
+FuzzyIndex serves the "no exact match" path: padded trigram postings pick
+the few records and terms that share the most trigrams with the query
+(Dice coefficient), and only those are re-scored with difflib's ratio.
+Each query stops after FUZZY_BUDGET_MS of CPU (collecting candidates may
+use half of it) or FUZZY_MAX_CANDIDATES re-scored records, whichever comes
+first; candidates left unscored are dropped, not ranked by Dice.
+"""
+
+import atexit
+import hashlib
+import heapq
+import json
+import os
+import threading
+import time
+from collections import Counter
+from difflib import SequenceMatcher
+
+from store import atomic_write_json, group_writer, _key_from_json
+
+NGRAM_SIZE = 3
+INDEX_FORMAT = 1
+NGRAM_SAVE_INTERVAL = float(os.environ.get("NGRAM_SAVE_INTERVAL", 30))
+FUZZY_BUDGET_MS = float(os.environ.get("FUZZY_BUDGET_MS", 25))
+FUZZY_MAX_CANDIDATES = int(os.environ.get("FUZZY_MAX_CANDIDATES", 200))
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    """Every distinct substring of text with length 1..n."""
+    grams = set()
+    for size in range(1, n + 1):
+        for i in range(len(text) - size + 1):
+            grams.add(text[i:i + size])
+    return grams
+
+
+class NgramIndex:
+    """Inverted n-gram index over the given fields of a store's records."""
+
+    def __init__(self, name, fields, key_of, path=None):
+        self.name = name
+        self.fields = tuple(fields)
+        self.key_of = key_of
+        self.path = path
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._texts = {}
+        self._records = {}
+        self._order = {}
+        self._next = 0
+        self._dirty = False
+        self._saved_at = 0.0
+        self.loads = 0
+        self.builds = 0
+        self.saves = 0
+        if path:
+            atexit.register(self.flush)
+
+    def _texts_of(self, record):
+        return tuple(str(record.get(field, "")).lower() for field in self.fields)
+
+    def _stamp(self):
+        digest = hashlib.sha1()
+        for key, texts in self._texts.items():
+            digest.update(json.dumps([key, texts]).encode())
+        return digest.hexdigest()
+
+    def _add_grams(self, key, texts):
+        for gram in set().union(*(ngrams(t) for t in texts)):
+            self._postings.setdefault(gram, set()).add(key)
+
+    def _remove_grams(self, key, texts):
+        for gram in set().union(*(ngrams(t) for t in texts)):
+            posting = self._postings[gram]
+            posting.discard(key)
+            if not posting:
+                del self._postings[gram]
+
+    def _load(self):
+        """Adopt the persisted postings if they were built from the current texts."""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("format") != INDEX_FORMAT or data.get("fields") != list(self.fields) \
+                or data.get("stamp") != self._stamp():
+            return False
+        keys = [_key_from_json(k) for k in data["keys"]]
+        self._postings = {gram: {keys[i] for i in positions} for gram, positions in data["postings"].items()}
+        return True
+
+    def reset(self, records):
+        with self._lock:
+            self._postings = {}
+            self._texts = {}
+            self._records = {}
+            self._order = {}
+            self._next = 0
+            for record in records:
+                key = self.key_of(record)
+                self._texts[key] = self._texts_of(record)
+                self._records[key] = record
+                self._order[key] = self._next
+                self._next += 1
+            if self.path and self._load():
+                self.loads += 1
+                return
+            self.builds += 1
+            for key, texts in self._texts.items():
+                self._add_grams(key, texts)
+            self._mark_dirty()
+
+    def apply(self, old, new):
+        with self._lock:
+            if new is None:
+                key = self.key_of(old)
+                self._remove_grams(key, self._texts.pop(key))
+                del self._records[key]
+                del self._order[key]
+                self._mark_dirty()
+                return
+            key = self.key_of(new)
+            texts = self._texts_of(new)
+            self._records[key] = new
+            if old is not None:
+                if texts == self._texts[key]:
+                    return
+                self._remove_grams(key, self._texts[key])
+            else:
+                self._order[key] = self._next
+                self._next += 1
+            # Updates keep their slot in _texts, so its order stays the store order
+            self._texts[key] = texts
+            self._add_grams(key, texts)
+            self._mark_dirty()
+
+    def _mark_dirty(self):
+        if self.path and not self._dirty:
+            self._dirty = True
+            delay = self._saved_at + NGRAM_SAVE_INTERVAL - time.monotonic()
+            if delay > 0:
+                timer = threading.Timer(delay, group_writer.schedule, (self,))
+                timer.daemon = True
+                timer.start()
+            else:
+                group_writer.schedule(self)
+
+    def flush(self):
+        """Write the postings to disk if they changed since the last write."""
+        with self._lock:
+            if not self._dirty:
+                return
+            keys = list(self._texts)
+            position = {key: i for i, key in enumerate(keys)}
+            data = {
+                "format": INDEX_FORMAT,
+                "fields": list(self.fields),
+                "stamp": self._stamp(),
+                "keys": keys,
+                "postings": {gram: sorted(position[k] for k in posting) for gram, posting in self._postings.items()},
+            }
+            self._dirty = False
+            self._saved_at = time.monotonic()  # Changes from here on wait a full interval
+        try:
+            atomic_write_json(self.path, data, indent=None)
+        except BaseException:
+            self._dirty = True  # The group writer schedules the retry
+            raise
+        self.saves += 1
+
+    def search_keys(self, query):
+        """Keys of the records where query is a substring of any indexed field."""
+        query = query.lower()
+        with self._lock:
+            if not query:
+                return list(self._texts)
+            if len(query) <= NGRAM_SIZE:
+                return list(self._postings.get(query, ()))
+            postings = []
+            for i in range(len(query) - NGRAM_SIZE + 1):
+                posting = self._postings.get(query[i:i + NGRAM_SIZE])
+                if not posting:
+                    return []
+                postings.append(posting)
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            return [k for k in candidates if any(query in t for t in self._texts[k])]
+
+    def search(self, query):
+        """Matching records in store order."""
+        with self._lock:
+            keys = sorted(self.search_keys(query), key=self._order.__getitem__)
+            return tuple(self._records[k] for k in keys)
+
+    def stats(self):
+        return {"name": self.name, "fields": list(self.fields), "path": self.path, "records": len(self._texts),
+                "grams": len(self._postings), "loads": self.loads, "builds": self.builds, "saves": self.saves}
+
+
+def padded_trigrams(text):
+    """Trigrams of text padded so that short words and word edges count too."""
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class FuzzyIndex:
+    """Trigram-similarity index for ranked fuzzy matches and "Did you mean?" terms.
+
+    fields are scored per record; the distinct values of suggest_fields also
+    form a vocabulary that suggest() draws from.
+    """
+
+    def __init__(self, name, fields, key_of, suggest_fields=(), budget_ms=None, max_candidates=None):
+        self.name = name
+        self.fields = tuple(fields)
+        self.suggest_fields = tuple(suggest_fields)
+        self.key_of = key_of
+        self.budget = (FUZZY_BUDGET_MS if budget_ms is None else budget_ms) / 1000.0
+        self.max_candidates = FUZZY_MAX_CANDIDATES if max_candidates is None else max_candidates
+        self._lock = threading.RLock()
+        self.queries = 0
+        self.over_budget = 0
+        self.reset(())
+
+    def _texts_of(self, record):
+        return tuple(str(record.get(field, "")).lower() for field in self.fields)
+
+    def reset(self, records):
+        with self._lock:
+            self._postings = {}      # trigram -> {key: fields containing it}
+            self._gram_counts = {}   # key -> trigram count per field
+            self._texts = {}
+            self._records = {}
+            self._order = {}
+            self._next = 0
+            self._terms = {f: {} for f in self.suggest_fields}          # term -> keys using it
+            self._term_postings = {f: {} for f in self.suggest_fields}  # trigram -> terms
+            for record in records:
+                self.apply(None, record)
+
+    def _index(self, key, texts, add):
+        counts = []
+        for position, text in enumerate(texts):
+            grams = padded_trigrams(text) if text else set()
+            counts.append(len(grams))
+            for gram in grams:
+                if add:
+                    self._postings.setdefault(gram, {}).setdefault(key, set()).add(position)
+                else:
+                    entry = self._postings[gram]
+                    entry[key].discard(position)
+                    if not entry[key]:
+                        del entry[key]
+                        if not entry:
+                            del self._postings[gram]
+        for field in self.suggest_fields:
+            term = texts[self.fields.index(field)]
+            if not term:
+                continue
+            users = self._terms[field]
+            if add:
+                if term not in users:
+                    users[term] = set()
+                    for gram in padded_trigrams(term):
+                        self._term_postings[field].setdefault(gram, set()).add(term)
+                users[term].add(key)
+            else:
+                users[term].discard(key)
+                if not users[term]:
+                    del users[term]
+                    for gram in padded_trigrams(term):
+                        postings = self._term_postings[field][gram]
+                        postings.discard(term)
+                        if not postings:
+                            del self._term_postings[field][gram]
+        return counts
+
+    def apply(self, old, new):
+        with self._lock:
+            if old is not None:
+                key = self.key_of(old)
+                self._index(key, self._texts.pop(key), add=False)
+                del self._gram_counts[key]
+                del self._records[key]
+                if new is None:
+                    del self._order[key]
+            if new is not None:
+                key = self.key_of(new)
+                if key not in self._order:
+                    self._order[key] = self._next
+                    self._next += 1
+                self._texts[key] = self._texts_of(new)
+                self._records[key] = new
+                self._gram_counts[key] = self._index(key, self._texts[key], add=True)
+
+    def search(self, query, accept=None, cutoff=0.35):
+        """Records scoring above cutoff, best first, as (record, score) pairs.
+
+        Candidates are ranked by trigram Dice similarity; the best of them
+        are re-scored with SequenceMatcher.ratio() (the score the catalogue
+        always used) until the CPU budget or candidate cap runs out. cutoff
+        applies to that ratio, and only re-scored records are returned.
+        Gathering candidates may use the first half of the budget; when it
+        runs out the query goes on with the postings read so far.
+        """
+        query = query.lower()
+        start = time.thread_time()
+        gather_deadline = start + self.budget / 2
+        deadline = start + self.budget
+        with self._lock:
+            self.queries += 1
+            grams = padded_trigrams(query)
+            shared = Counter()
+            over = False
+            for gram in grams:
+                for i, (key, positions) in enumerate(self._postings.get(gram, {}).items()):
+                    if i % 256 == 0 and time.thread_time() > gather_deadline:
+                        over = True
+                        break
+                    for position in positions:
+                        shared[key, position] += 1
+                if over:
+                    break
+            dice = {}
+            for (key, position), common in shared.items():
+                score = 2.0 * common / (len(grams) + self._gram_counts[key][position])
+                if score > dice.get(key, 0.0):
+                    dice[key] = score
+            if accept is not None:
+                dice = {k: v for k, v in dice.items() if accept(self._records[k])}
+            ranked = heapq.nlargest(self.max_candidates, dice, key=lambda k: (dice[k], -self._order[k]))
+            results = []
+            for key in ranked:
+                if time.thread_time() > deadline:
+                    # Out of budget: the rest were never scored on the cutoff's scale, so drop them
+                    over = True
+                    break
+                score = max(SequenceMatcher(None, query, text).ratio() for text in self._texts[key])
+                results.append((key, score))
+            if over:
+                self.over_budget += 1
+            results = [(k, score) for k, score in results if score > cutoff]
+            results.sort(key=lambda item: (-item[1], self._order[item[0]]))
+            return [(self._records[k], score) for k, score in results]
+
+    def suggest(self, query, field, n=5, cutoff=0.4, accept=None):
+        """Up to n distinct values of field that look like query, best first."""
+        query = query.lower()
+        with self._lock:
+            grams = padded_trigrams(query)
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._term_postings[field].get(gram, ()))
+            users = self._terms[field]
+            if accept is not None:
+                shared = Counter({t: c for t, c in shared.items()
+                                  if any(accept(self._records[k]) for k in users[t])})
+            dice = {t: 2.0 * c / (len(grams) + len(padded_trigrams(t))) for t, c in shared.items()}
+            scored = []
+            for term in heapq.nlargest(max(n * 10, 50), dice, key=dice.__getitem__):
+                score = SequenceMatcher(None, query, term).ratio()
+                if score >= cutoff:
+                    scored.append((score, term))
+            scored.sort(key=lambda item: (-item[0], item[1]))
+            return [term for _, term in scored[:n]]
+
+    def stats(self):
+        return {"name": self.name, "fields": list(self.fields), "records": len(self._texts),
+                "grams": len(self._postings), "queries": self.queries, "over_budget": self.over_budget,
+                "budget_ms": self.budget * 1000, "max_candidates": self.max_candidates}
@@ -0,0 +1,228 @@
+# sort_index.py
+"""Pre-sorted orderings of store records, maintained on every write.
+
+SortIndex is a store listener holding, for each named sort key, the
+records' sort values (computed once when a record is written, e.g. the
+natural number in a part_id) and a list of (value, store ordinal, key)
+kept sorted with bisect. ordered() turns any subset of records into the
+requested order: a large subset in store order is produced by walking the
+pre-sorted list and keeping its members, a small one is sorted on the
+cached values. Either way ties keep their input order, exactly like
+sorted() on the raw records.
+
+KeysetIndex keeps records in one sort order, once overall and once per
+value of each filter field, and serves pages after or before a cursor
+(the last or first row's (sort value, key)) by bisecting to it and
+walking, so a page costs the same however many records precede it.
+"""
+
+import bisect
+import itertools
+import re
+import threading
+
+
+def natural_number(part_id):
+    """The first run of digits in part_id as an int (P010 -> 10), or 0."""
+    match = re.search(r'\d+', part_id)
+    return int(match.group()) if match else 0
+
+
+class SortIndex:
+    """Records ordered by each of several sort keys."""
+
+    def __init__(self, key_of, sort_keys):
+        self.key_of = key_of
+        self.sort_keys = dict(sort_keys)
+        self._lock = threading.RLock()
+        self.walks = 0
+        self.sorts = 0
+        self.reset(())
+
+    def reset(self, records):
+        with self._lock:
+            self._values = {name: {} for name in self.sort_keys}
+            self._sorted = {name: [] for name in self.sort_keys}
+            self._order = {}
+            self._next = 0
+            for record in records:
+                key = self.key_of(record)
+                self._order[key] = self._next
+                self._next += 1
+                for name, func in self.sort_keys.items():
+                    value = func(record)
+                    self._values[name][key] = value
+                    self._sorted[name].append((value, self._order[key], key))
+            for entries in self._sorted.values():
+                entries.sort()
+
+    def apply(self, old, new):
+        with self._lock:
+            key = self.key_of(new if new is not None else old)
+            if old is not None:
+                for name in self.sort_keys:
+                    entries = self._sorted[name]
+                    entry = (self._values[name].pop(key), self._order[key], key)
+                    del entries[bisect.bisect_left(entries, entry)]
+                if new is None:
+                    del self._order[key]
+                    return
+            if key not in self._order:
+                self._order[key] = self._next
+                self._next += 1
+            for name, func in self.sort_keys.items():
+                value = func(new)
+                self._values[name][key] = value
+                bisect.insort(self._sorted[name], (value, self._order[key], key))
+
+    def ordered(self, records, name, reverse=False, store_order=True):
+        """records sorted by the named key; store_order says they arrive in store order."""
+        with self._lock:
+            values = self._values[name]
+            wanted = {self.key_of(r): r for r in records}
+            if store_order and len(wanted) * 8 >= len(values) and all(k in values for k in wanted):
+                self.walks += 1
+                entries = self._sorted[name]
+                if not reverse:
+                    return [wanted[k] for _, _, k in entries if k in wanted]
+                # Descending by value, but equal values stay in store order
+                result = []
+                for _, run in itertools.groupby(reversed(entries), key=lambda e: e[0]):
+                    result.extend(wanted[k] for _, _, k in reversed(list(run)) if k in wanted)
+                return result
+            self.sorts += 1
+            func = self.sort_keys[name]
+            return sorted(
+                records,
+                key=lambda r: values[self.key_of(r)] if self.key_of(r) in values else func(r),
+                reverse=reverse,
+            )
+
+    def stats(self):
+        return {"sort_keys": list(self.sort_keys), "records": len(self._order),
+                "walks": self.walks, "sorts": self.sorts}
+
+
+class KeysetIndex:
+    """Records in one sort order, partitioned by filter fields, read a page at a time."""
+
+    def __init__(self, key_of, sort_key, filters):
+        self.key_of = key_of
+        self.sort_key = sort_key
+        self.filters = dict(filters)
+        self._lock = threading.RLock()
+        self.pages = 0
+        self.scanned = 0
+        self.reset(())
+
+    def reset(self, records):
+        with self._lock:
+            self._records = {}
+            self._entries = {}
+            self._lists = {None: []}
+            for record in records:
+                self._add(record)
+            for entries in self._lists.values():
+                entries.sort()
+
+    def _filter_values(self, record):
+        return {name: record.get(field) for name, field in self.filters.items()}
+
+    def _add(self, record, insort=False):
+        key = self.key_of(record)
+        entry = (self.sort_key(record), key)
+        values = self._filter_values(record)
+        self._records[key] = record
+        self._entries[key] = (entry, values)
+        for list_key in [None] + list(values.items()):
+            entries = self._lists.setdefault(list_key, [])
+            if insort:
+                bisect.insort(entries, entry)
+            else:
+                entries.append(entry)
+
+    def _remove(self, key):
+        entry, values = self._entries.pop(key)
+        del self._records[key]
+        for list_key in [None] + list(values.items()):
+            entries = self._lists[list_key]
+            del entries[bisect.bisect_left(entries, entry)]
+            if not entries and list_key is not None:
+                del self._lists[list_key]
+
+    def apply(self, old, new):
+        with self._lock:
+            if old is not None:
+                self._remove(self.key_of(old))
+            if new is not None:
+                self._add(new, insort=True)
+
+    def values(self, name):
+        """Distinct values of the named filter field, sorted."""
+        with self._lock:
+            return sorted(list_key[1] for list_key in self._lists
+                          if list_key is not None and list_key[0] == name and list_key[1] not in (None, ""))
+
+    def cursor(self, record):
+        """The (sort value, key) position of record, to pass as after/before."""
+        return (self.sort_key(record), self.key_of(record))
+
+    def page(self, filters=None, after=None, before=None, limit=25, reverse=True, match=None):
+        """Up to limit records in sort order (descending if reverse) that have
+        every filters value and pass match(record), starting after (or ending
+        before) a cursor. Returns (records, has_more) where has_more says there
+        are further records in the direction walked."""
+        filters = {name: value for name, value in (filters or {}).items() if value not in (None, "")}
+        with self._lock:
+            self.pages += 1
+            # Walk the smallest matching partition, checking any other filters per record
+            lists = [self._lists.get((name, value), []) for name, value in filters.items()]
+            entries = min(lists, key=len) if lists else self._lists[None]
+            step = -1 if reverse else 1
+            if before is not None:
+                step = -step
+                cursor = tuple(before)
+            else:
+                cursor = tuple(after) if after is not None else None
+            if cursor is None:
+                i = len(entries) - 1 if step < 0 else 0
+            elif step < 0:
+                i = bisect.bisect_left(entries, cursor) - 1
+            else:
+                i = bisect.bisect_right(entries, cursor)
+
+            result = []
+            while 0 <= i < len(entries) and len(result) <= limit:
+                key = entries[i][1]
+                i += step
+                self.scanned += 1
+                _, values = self._entries[key]
+                if any(values[name] != value for name, value in filters.items()):
+                    continue
+                record = self._records[key]
+                if match is None or match(record):
+                    result.append(record)
+            has_more = len(result) > limit
+            result = result[:limit]
+            if before is not None:
+                result.reverse()
+            return result, has_more
+
+    def records(self, filters=None, reverse=True):
+        """Every record that has all filters values, in sort order (descending
+        if reverse), read from the smallest matching partition."""
+        filters = {name: value for name, value in (filters or {}).items() if value not in (None, "")}
+        with self._lock:
+            lists = [self._lists.get((name, value), []) for name, value in filters.items()]
+            entries = min(lists, key=len) if lists else self._lists[None]
+            result = []
+            for _, key in (reversed(entries) if reverse else entries):
+                _, values = self._entries[key]
+                if all(values[name] == value for name, value in filters.items()):
+                    result.append(self._records[key])
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {"records": len(self._records), "filters": list(self.filters),
+                    "partitions": len(self._lists) - 1, "pages": self.pages, "scanned": self.scanned}
@@ -0,0 +1,1084 @@
+# store.py
+"""Shared storage layer for the JSON data files.
+
+Every store keeps the parsed file in memory and only re-reads it when the
+file's (mtime, size, inode) signature changes, so repeated GETs cost one
+os.stat() instead of a full JSON parse. Readers get an immutable snapshot;
+writers take a mutable copy with load() and hand it back to save(), or
+change a single record with upsert()/delete().
+
+STORE_ENGINE selects how stores are persisted:
+  json     - rewrite the whole file on every save (default)
+  journal  - append each mutation to <name>.journal and fold it into the
+             JSON snapshot in the background once it grows too big or old
+  sqlite   - one table per store in SQLITE_PATH, with the primary key and
+             declared indexes as real indexed columns
+
+All engines share the same API: snapshot/load/save for whole lists and
+get/find/upsert/upsert_many/delete for single records or batches. Files
+are replaced atomically (temp file, fsync, rename) and every write takes
+an advisory lock on <file>.lock, so several gunicorn workers can share
+the same data files.
+Wrap read-modify-write cycles in `with store.lock():` to keep them atomic
+across workers.
+
+STORE_DURABILITY picks when writes reach disk:
+  sync   - before upsert()/delete() return (default)
+  group  - the cache is updated at once and a background writer flushes all
+           dirty stores every STORE_FLUSH_INTERVAL seconds and at exit, so a
+           burst of cart clicks or stock edits costs one write. A worker
+           serves its own unflushed changes until they are written, so
+           cross-worker locking is only as fresh as the flush window.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
+STORE_ENGINE = os.environ.get("STORE_ENGINE", "json").lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "wdp_data.db")
+SQLITE_TOMBSTONE_VERSIONS = int(os.environ.get("SQLITE_TOMBSTONE_VERSIONS", 1000))
+JOURNAL_MAX_BYTES = int(os.environ.get("JOURNAL_MAX_BYTES", 1024 * 1024))
+JOURNAL_MAX_AGE = float(os.environ.get("JOURNAL_MAX_AGE", 300))
+STORE_DURABILITY = os.environ.get("STORE_DURABILITY", "sync").lower()
+STORE_FLUSH_INTERVAL = float(os.environ.get("STORE_FLUSH_INTERVAL", 0.05))
+
+
+class FrozenDict(dict):
+    """Read-only dict used for records inside store snapshots."""
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("store snapshots are read-only, use load() for a mutable copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(value):
+    """Recursively convert dicts/lists into FrozenDict/tuple."""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Recursively convert a frozen value back into plain dicts/lists."""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def atomic_write_json(path, data, indent=2):
+    """Write JSON to a temp file, fsync it, then rename it over path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class FileLock:
+    """Reentrant exclusive lock shared by threads and processes.
+
+    A thread lock serialises callers inside this process; the outermost
+    acquire also takes an fcntl.flock on the lock file so other gunicorn
+    workers wait as well.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+
+class GroupCommitWriter:
+    """Background thread that flushes dirty stores once per window."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._dirty = set()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, store):
+        with self._cond:
+            self._dirty.add(store)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="store-group-commit", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty:
+                    self._cond.wait()
+            # Let the window fill up so a burst of writes becomes one flush
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write every dirty store now."""
+        with self._cond:
+            stores, self._dirty = self._dirty, set()
+        for store in stores:
+            try:
+                store.flush()
+            except Exception as e:
+                print(f"Error flushing {store.name} store: {e}")
+                self.schedule(store)
+
+
+group_writer = GroupCommitWriter(STORE_FLUSH_INTERVAL)
+atexit.register(group_writer.flush)
+
+_stores = []
+
+
+def make_key_func(key):
+    """Build a record -> primary key function from a field name or tuple of names."""
+    if isinstance(key, tuple):
+        return lambda record: tuple(record.get(k) for k in key)
+    return lambda record: record.get(key)
+
+
+def make_index_func(spec):
+    """Build a record -> index value function from a field name or callable."""
+    if callable(spec):
+        return spec
+    return lambda record: record.get(spec)
+
+
+def _key_from_json(value):
+    # Composite keys round-trip through JSON as lists
+    return tuple(value) if isinstance(value, list) else value
+
+
+class HashIndex:
+    """Secondary index mapping an index value to the records that have it.
+
+    Like every store listener it is rebuilt by reset(records) whenever the
+    store reloads from disk and patched by apply(old, new) on each mutation
+    (old is None for inserts, new is None for deletes). Lookups return records
+    in store order.
+    """
+
+    def __init__(self, func, key_of):
+        self.func = func
+        self.key_of = key_of
+        self._buckets = {}
+        self._order = {}
+        self._next = 0
+
+    def reset(self, records):
+        self._buckets = {}
+        self._order = {}
+        self._next = 0
+        for record in records:
+            self.apply(None, record)
+
+    def apply(self, old, new):
+        if old is not None and new is not None and self.func(old) == self.func(new):
+            self._buckets[self.func(new)][self.key_of(new)] = new
+            return
+        if old is not None:
+            bucket = self._buckets.get(self.func(old))
+            if bucket is not None:
+                bucket.pop(self.key_of(old), None)
+                if not bucket:
+                    del self._buckets[self.func(old)]
+            if new is None:
+                self._order.pop(self.key_of(old), None)
+        if new is not None:
+            key = self.key_of(new)
+            if key not in self._order:
+                self._order[key] = self._next
+                self._next += 1
+            self._buckets.setdefault(self.func(new), {})[key] = new
+
+    def lookup(self, value):
+        bucket = self._buckets.get(value, {})
+        return tuple(bucket[k] for k in sorted(bucket, key=self._order.__getitem__))
+
+
+class JsonStore:
+    """A list of records persisted as one JSON file, cached in memory.
+
+    The cache is a dict from primary key to frozen record, built once per
+    load and patched on every mutation, so get() and the duplicate checks
+    built on it are O(1). Secondary indexes and other listeners registered
+    with add_listener() are kept in sync the same way.
+    """
+
+    engine = "json"
+
+    def __init__(self, name, path, key, indexes=None, default=None, durability=None):
+        self.name = name
+        self.path = path
+        self.key = key
+        self.key_of = make_key_func(key)
+        self.indexes = dict(indexes or {})
+        self._index_funcs = {n: make_index_func(spec) for n, spec in self.indexes.items()}
+        self._hash_indexes = {n: HashIndex(f, self.key_of) for n, f in self._index_funcs.items()}
+        self._listeners = list(self._hash_indexes.values())
+        self._default = default or list
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(self._lock_path())
+        self._signature = None
+        self._by_key = None
+        self._snapshot = None
+        self.durability = (durability or STORE_DURABILITY).lower()
+        self._pending = []
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.incremental_reloads = 0
+        self.flushes = 0
+
+    def _lock_path(self):
+        return self.path + ".lock"
+
+    @contextmanager
+    def lock(self):
+        """Hold the cross-process write lock, e.g. around get() ... upsert()."""
+        with self._file_lock:
+            yield self
+
+    def add_listener(self, listener):
+        """Keep listener.reset(records)/apply(old, new) in sync with this store."""
+        with self._lock:
+            self._listeners.append(listener)
+            if self._by_key is not None:
+                listener.reset(tuple(self._by_key.values()))
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return self._default()
+        with open(self.path, "r") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return []
+
+    def _write(self, records):
+        atomic_write_json(self.path, records)
+
+    def _reset(self, records):
+        """Replace the cache with records; caller holds self._lock."""
+        self._by_key = {}
+        for record in freeze(records):
+            self._by_key[self.key_of(record)] = record
+        self._snapshot = None
+        self._generation += 1
+        for listener in self._listeners:
+            listener.reset(tuple(self._by_key.values()))
+
+    def _reload(self, records):
+        """Bring the cache to records read from disk; caller holds self._lock.
+
+        The first load builds everything. Later ones (another worker wrote)
+        apply only the records that differ through _change(), so listeners
+        such as the search and sort indexes are patched rather than rebuilt;
+        when most records changed a full reset is cheaper and is used instead.
+        """
+        if self._by_key is None:
+            self._reset(records)
+            return
+        fresh = {}
+        for record in freeze(records):
+            fresh[self.key_of(record)] = record
+        removed = [key for key in self._by_key if key not in fresh]
+        changed = [(key, record) for key, record in fresh.items() if self._by_key.get(key) != record]
+        if (len(removed) + len(changed)) * 2 > max(len(fresh), 1):
+            self._reset(records)
+            return
+        self.incremental_reloads += 1
+        for key in removed:
+            self._change(key, None)
+        for key, record in changed:
+            self._change(key, record)
+
+    def _change(self, key, record):
+        """Put (or with record=None remove) one cached record and notify listeners."""
+        old = self._by_key.get(key)
+        if record is None:
+            if old is None:
+                return
+            del self._by_key[key]
+        else:
+            self._by_key[key] = record
+        self._snapshot = None
+        self._generation += 1
+        for listener in self._listeners:
+            listener.apply(old, record)
+
+    def _refresh(self):
+        """Bring the cache up to date with disk; caller holds self._lock."""
+        if self._pending:
+            if self._by_key is None:
+                # A failed flush dropped the cache: reload and put the unflushed writes back on top
+                self._sync_from_disk()
+                for key, record in self._pending:
+                    self._change(key, record)
+                return
+            # Unflushed group-commit writes: this worker's copy is the newest
+            self.hits += 1
+            return
+        self._sync_from_disk()
+
+    def _sync_from_disk(self):
+        signature = self._file_signature()
+        if self._by_key is not None and signature == self._signature:
+            self.hits += 1
+            return
+        self.misses += 1
+        self._reload(self._read())
+        self._signature = signature
+
+    def snapshot(self):
+        """Return the current records as an immutable tuple of FrozenDicts."""
+        with self._lock:
+            self._refresh()
+            if self._snapshot is None:
+                self._snapshot = tuple(self._by_key.values())
+            return self._snapshot
+
+    def version(self):
+        """Token that changes whenever the records this worker sees change."""
+        with self._lock:
+            self._refresh()
+            return self._generation
+
+    def durable_version(self):
+        """Token naming the stored records for every worker, or None while
+        this worker has group-commit writes that are not on disk yet."""
+        with self._lock:
+            self._refresh()
+            if self._pending:
+                return None
+            return self._durable_signature()
+
+    def _durable_signature(self):
+        return self._signature
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._by_key)
+
+    def load(self):
+        """Return a mutable copy of the records for a load-modify-save cycle."""
+        return thaw(self.snapshot())
+
+    def _persist(self):
+        """Write the cached records back to disk; on failure drop the cache."""
+        try:
+            self._write(list(self._by_key.values()))
+        except BaseException:
+            self._by_key = None
+            raise
+        self._signature = self._file_signature()
+
+    def _commit(self, changes):
+        """Apply (key, record or None) changes to the cache and persist them,
+        now or at the next group flush; caller holds both locks."""
+        for key, record in changes:
+            self._change(key, record)
+        if self.durability == "group":
+            self._pending.extend(changes)
+            group_writer.schedule(self)
+        else:
+            self._write_changes(changes)
+
+    def _write_changes(self, changes):
+        self._persist()
+
+    def _flush_changes(self, changes):
+        if self._file_signature() != self._signature:
+            # Another worker rewrote the file since we loaded it: replay our changes onto theirs
+            self._sync_from_disk()
+            for key, record in changes:
+                self._change(key, record)
+        self._persist()
+
+    def flush(self):
+        """Write out pending group-commit changes, if any."""
+        with self._file_lock, self._lock:
+            if not self._pending:
+                return
+            self._refresh()  # rebuilds the cache if an earlier flush failed
+            changes, self._pending = self._pending, []
+            try:
+                self._flush_changes(changes)
+            except BaseException:
+                # Keep the writes queued for the next flush; reads rebuild the cache if it was dropped
+                self._pending = changes + self._pending
+                raise
+            self.flushes += 1
+
+    def save(self, records):
+        """Persist records and refresh the cache without re-reading the file."""
+        with self._file_lock, self._lock:
+            self._pending = []
+            self._reset(records)
+            self._persist()
+
+    def get(self, key):
+        """Return the frozen record with the given primary key, or None."""
+        with self._lock:
+            self._refresh()
+            return self._by_key.get(key)
+
+    def find(self, index, value):
+        """Return the frozen records whose declared index equals value."""
+        with self._lock:
+            self._refresh()
+            return self._hash_indexes[index].lookup(value)
+
+    def upsert(self, record):
+        """Insert a record, or replace the one with the same primary key."""
+        with self._file_lock, self._lock:
+            self._refresh()
+            self._commit([(self.key_of(record), freeze(record))])
+
+    def upsert_many(self, records):
+        """Upsert several records with a single write."""
+        with self._file_lock, self._lock:
+            self._refresh()
+            changes = [(self.key_of(r), freeze(r)) for r in records]
+            if changes:
+                self._commit(changes)
+
+    def delete(self, key):
+        """Remove the record with the given primary key, if present."""
+        with self._file_lock, self._lock:
+            self._refresh()
+            if key in self._by_key:
+                self._commit([(key, None)])
+
+    def delete_many(self, keys):
+        """Remove the records with the given primary keys with a single write."""
+        with self._file_lock, self._lock:
+            self._refresh()
+            changes = [(key, None) for key in keys if key in self._by_key]
+            if changes:
+                self._commit(changes)
+
+    def stats(self):
+        return {"name": self.name, "engine": self.engine, "path": self.path,
+                "durability": self.durability, "hits": self.hits, "misses": self.misses,
+                "incremental_reloads": self.incremental_reloads,
+                "pending": len(self._pending), "flushes": self.flushes}
+
+
+class JournalStore(JsonStore):
+    """JsonStore that appends one JSON line per mutation instead of rewriting.
+
+    The data file holds the last compacted snapshot and <name>.journal holds
+    every mutation since. Loading is snapshot plus replay; when another
+    process only appended to the journal, just the new tail is replayed.
+    """
+
+    engine = "journal"
+
+    def __init__(self, name, path, key, indexes=None, default=None, durability=None):
+        super().__init__(name, path, key, indexes=indexes, default=default, durability=durability)
+        self.journal_path = os.path.splitext(path)[0] + ".journal"
+        self._journal_offset = 0
+        self._compacting = False
+        self._last_compaction = time.time()
+        self.replays = 0
+        self.compactions = 0
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def _apply(self, op):
+        if op["op"] == "put":
+            record = freeze(op["record"])
+            self._change(self.key_of(record), record)
+        elif op["op"] == "del":
+            self._change(_key_from_json(op["key"]), None)
+
+    def _replay(self, offset):
+        with open(self.journal_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write at the tail, picked up next time
+                self._apply(json.loads(line))
+                offset += len(line)
+        self._journal_offset = offset
+
+    def _sync_from_disk(self):
+        signature = self._file_signature()
+        journal_size = self._journal_size()
+        if self._by_key is not None and signature == self._signature:
+            if journal_size == self._journal_offset:
+                self.hits += 1
+                return
+            if journal_size > self._journal_offset:
+                self.replays += 1
+                self._replay(self._journal_offset)
+                return
+        self.misses += 1
+        self._reload(self._read())
+        self._signature = signature
+        self._journal_offset = 0
+        if journal_size:
+            self._replay(0)
+
+    def _write_changes(self, changes):
+        """Append changes as whole journal lines with a single fsync."""
+        if self._journal_size() != self._journal_offset:
+            # Catch up with lines other workers appended since our last read
+            self._sync_from_disk()
+            for key, record in changes:
+                self._change(key, record)
+        ops = [{"op": "del", "key": key} if record is None else {"op": "put", "record": record}
+               for key, record in changes]
+        data = "".join(json.dumps(op) + "\n" for op in ops)
+        with open(self.journal_path, "a") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_offset += len(data.encode())
+        self._maybe_compact()
+
+    _flush_changes = _write_changes
+
+    def _durable_signature(self):
+        return (self._signature, self._journal_offset)
+
+    def save(self, records):
+        """Journal only the records that differ from the current state."""
+        with self._file_lock, self._lock:
+            self._refresh()
+            incoming = {}
+            for record in records:
+                incoming[self.key_of(record)] = freeze(record)
+            changes = [(key, None) for key in self._by_key if key not in incoming]
+            changes += [(key, record) for key, record in incoming.items() if self._by_key.get(key) != record]
+            if changes:
+                self._commit(changes)
+
+    def _maybe_compact(self):
+        size = self._journal_offset
+        too_old = size and time.time() - self._last_compaction >= JOURNAL_MAX_AGE
+        if self._compacting or not (size >= JOURNAL_MAX_BYTES or too_old):
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name=f"compact-{self.name}", daemon=True).start()
+
+    def compact(self):
+        """Fold the journal into the JSON snapshot and truncate it."""
+        try:
+            with self._file_lock, self._lock:
+                self.flush()
+                self._refresh()
+                JsonStore._write(self, list(self._by_key.values()))
+                open(self.journal_path, "w").close()
+                self._signature = self._file_signature()
+                self._journal_offset = 0
+                self._last_compaction = time.time()
+                self.compactions += 1
+        finally:
+            self._compacting = False
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(journal_bytes=self._journal_offset,
+                     replays=self.replays, compactions=self.compactions)
+        return stats
+
+
+_connections = threading.local()
+
+
+def sqlite_connection(db_path=None):
+    """Per-thread autocommit connection to the shared SQLite database."""
+    db_path = db_path or SQLITE_PATH
+    conns = getattr(_connections, "conns", None)
+    if conns is None:
+        conns = _connections.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS store_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        # Keys deleted at each version (NULL: the whole table was replaced), for delta syncs
+        conn.execute("CREATE TABLE IF NOT EXISTS store_deletes (name TEXT NOT NULL, key TEXT, version INTEGER NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_store_deletes ON store_deletes (name, version)")
+        conns[db_path] = conn
+    return conn
+
+
+class SqliteStore(JsonStore):
+    """Store backed by one SQLite table.
+
+    The primary key fields and every declared index are real columns next to
+    the JSON-encoded record, so get() and find() are indexed point queries.
+    Rowid order preserves the original list order. A per-store version row is
+    bumped in the same transaction as every write, which is what the cached
+    snapshot is validated against. Each row carries the version that last
+    wrote it and deletes leave a tombstone in store_deletes, so a worker
+    whose cache is a few versions behind reads only what changed since and
+    patches its cache (and listeners) record by record.
+    """
+
+    engine = "sqlite"
+
+    def __init__(self, name, path, key, indexes=None, default=None, durability=None, db_path=None):
+        self.db_path = db_path or SQLITE_PATH
+        super().__init__(name, path, key, indexes=indexes, default=default, durability=durability)
+        self.key_columns = key if isinstance(key, tuple) else (key,)
+        # An index on a key field reads the key column; it gets no column of its own
+        self._index_columns = [c for c in self.indexes if c not in self.key_columns]
+        self._schema_ready = False
+
+    def _lock_path(self):
+        return f"{self.db_path}.{self.name}.lock"
+
+    @property
+    def _conn(self):
+        conn = sqlite_connection(self.db_path)
+        if not self._schema_ready:
+            self._ensure_schema(conn)
+        return conn
+
+    def _ensure_schema(self, conn):
+        columns = list(self.key_columns) + self._index_columns
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.name} ({', '.join(columns)}, data TEXT NOT NULL, "
+            f"row_version INTEGER NOT NULL DEFAULT 0, PRIMARY KEY ({', '.join(self.key_columns)}))"
+        )
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({self.name})")}
+        if "row_version" not in existing:
+            # Table from before delta syncs: existing rows count as written at version 0
+            conn.execute(f"ALTER TABLE {self.name} ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.name}__row_version ON {self.name} (row_version)")
+        missing = [c for c in self._index_columns if c not in existing]
+        if missing:
+            # Index declared after the table was created: add and backfill the column
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for column in missing:
+                    conn.execute(f"ALTER TABLE {self.name} ADD COLUMN {column}")
+                rows = conn.execute(f"SELECT rowid, data FROM {self.name}").fetchall()
+                for rowid, data in rows:
+                    record = json.loads(data)
+                    conn.execute(
+                        f"UPDATE {self.name} SET {', '.join(f'{c} = ?' for c in missing)} WHERE rowid = ?",
+                        [self._index_funcs[c](record) for c in missing] + [rowid],
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        for index in self.indexes:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.name}_{index} ON {self.name} ({index})")
+        self._schema_ready = True
+
+    def _row(self, record, version):
+        key = self.key_of(record)
+        key_values = key if isinstance(key, tuple) else (key,)
+        index_values = tuple(self._index_funcs[c](record) for c in self._index_columns)
+        return key_values + index_values + (json.dumps(record), version)
+
+    def _key_clause(self, key):
+        key_values = key if isinstance(key, tuple) else (key,)
+        return " AND ".join(f"{c} = ?" for c in self.key_columns), key_values
+
+    def _version(self, conn):
+        row = conn.execute("SELECT version FROM store_versions WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else None
+
+    def _write_rows(self, conn, records, version):
+        columns = list(self.key_columns) + self._index_columns + ["data", "row_version"]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in self.key_columns)
+        conn.executemany(
+            f"INSERT INTO {self.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT({', '.join(self.key_columns)}) DO UPDATE SET {updates}",
+            [self._row(r, version) for r in records],
+        )
+
+    def _sync_from_disk(self):
+        conn = self._conn
+        conn.execute("BEGIN")  # One read snapshot for the version and the rows
+        try:
+            version = self._version(conn)
+            if self._by_key is not None and version == self._signature:
+                self.hits += 1
+                return
+            self.misses += 1
+            if (self._by_key is not None and self._signature is not None and version is not None
+                    and version - self._signature <= SQLITE_TOMBSTONE_VERSIONS):
+                deleted = [row[0] for row in conn.execute(
+                    "SELECT key FROM store_deletes WHERE name = ? AND version > ?", (self.name, self._signature))]
+                rows = [] if None in deleted else conn.execute(
+                    f"SELECT data FROM {self.name} WHERE row_version > ? ORDER BY rowid", (self._signature,)).fetchall()
+                # Same threshold as _reload(): past half the records a rebuild is cheaper
+                if None not in deleted and (len(deleted) + len(rows)) * 2 <= max(len(self._by_key), 1):
+                    self.incremental_reloads += 1
+                    # Deletes first: a key deleted and written again since still has its row
+                    for key in deleted:
+                        self._change(_key_from_json(json.loads(key)), None)
+                    for (data,) in rows:
+                        record = freeze(json.loads(data))
+                        self._change(self.key_of(record), record)
+                    self._signature = version
+                    return
+            if version is None:
+                records = self._default()
+            else:
+                records = [json.loads(row[0]) for row in conn.execute(f"SELECT data FROM {self.name} ORDER BY rowid")]
+            self._reset(records)
+            self._signature = version
+        finally:
+            conn.execute("COMMIT")
+
+    def _transaction(self, changes, replace_all=False, patch_cache=True):
+        """Write changes in one transaction and keep the cache coherent.
+
+        When the cache was current before the write it is patched in place
+        (or just re-stamped when patch_cache is false because the changes are
+        already in it); otherwise the next read catches up on it as a delta.
+        """
+        conn = self._conn
+        with self._file_lock, self._lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cache_current, version, changed = self._write_in(conn, changes, replace_all)
+                if not changed:
+                    conn.execute("ROLLBACK")  # Also undoes the version bump
+                    return
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._written(changes, cache_current, version, patch_cache)
+
+    def _write_in(self, conn, changes, replace_all=False):
+        """Write changes inside the caller's transaction; returns (cache was
+        current, new version, rows changed)."""
+        cache_current = self._by_key is not None and self._version(conn) == self._signature
+        conn.execute(
+            "INSERT INTO store_versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+            (self.name,),
+        )
+        version = self._version(conn)
+        changed = 0
+        if replace_all:
+            conn.execute(f"DELETE FROM {self.name}")
+            conn.execute("INSERT INTO store_deletes (name, key, version) VALUES (?, NULL, ?)",
+                         (self.name, version))
+            changed = 1
+        puts = [record for _, record in changes if record is not None]
+        if puts:
+            self._write_rows(conn, puts, version)
+            changed += len(puts)
+        for key, record in changes:
+            if record is None:
+                where, params = self._key_clause(key)
+                deleted = conn.execute(f"DELETE FROM {self.name} WHERE {where}", params).rowcount
+                if deleted:
+                    conn.execute("INSERT INTO store_deletes (name, key, version) VALUES (?, ?, ?)",
+                                 (self.name, json.dumps(key), version))
+                changed += deleted
+        conn.execute("DELETE FROM store_deletes WHERE name = ? AND version <= ?",
+                     (self.name, version - SQLITE_TOMBSTONE_VERSIONS))
+        return cache_current, version, changed
+
+    def _written(self, changes, cache_current, version, patch_cache=True):
+        """Bring the cache up to a committed write; caller holds self._lock."""
+        if cache_current:
+            if patch_cache:
+                for key, record in changes:
+                    self._change(key, record)
+            self._signature = version
+        # Otherwise the next read catches up on this write and the ones before it as a delta
+
+    def _commit(self, changes):
+        if self.durability == "group":
+            # Reads are served from the cache while writes are pending
+            self._refresh()
+            JsonStore._commit(self, changes)
+        else:
+            self._transaction(changes)
+
+    def _flush_changes(self, changes):
+        self._transaction(changes, patch_cache=False)
+
+    def save(self, records):
+        with self._file_lock, self._lock:
+            self._pending = []
+            self._transaction([(self.key_of(r), r) for r in records], replace_all=True, patch_cache=False)
+            self._reset(records)
+            self._signature = self._version(self._conn)
+
+    def get(self, key):
+        # Checked under the lock: a group flush in progress has taken _pending but not committed it yet
+        with self._lock:
+            if self._pending:
+                return JsonStore.get(self, key)
+        where, params = self._key_clause(key)
+        row = self._conn.execute(f"SELECT data FROM {self.name} WHERE {where}", params).fetchone()
+        return freeze(json.loads(row[0])) if row else None
+
+    def find(self, index, value):
+        with self._lock:
+            if self._pending:
+                return JsonStore.find(self, index, value)
+        if index not in self.indexes:
+            raise KeyError(index)
+        rows = self._conn.execute(f"SELECT data FROM {self.name} WHERE {index} = ? ORDER BY rowid", (value,))
+        return tuple(freeze(json.loads(row[0])) for row in rows)
+
+    def upsert(self, record):
+        with self._file_lock, self._lock:
+            self._commit([(self.key_of(record), freeze(record))])
+
+    def upsert_many(self, records):
+        changes = [(self.key_of(r), freeze(r)) for r in records]
+        if changes:
+            with self._file_lock, self._lock:
+                self._commit(changes)
+
+    def delete(self, key):
+        with self._file_lock, self._lock:
+            self._commit([(key, None)])
+
+    def delete_many(self, keys):
+        changes = [(key, None) for key in keys]
+        if changes:
+            with self._file_lock, self._lock:
+                self._commit(changes)
+
+    def stats(self):
+        stats = super().stats()
+        stats["path"] = f"{self.db_path}:{self.name}"
+        return stats
+
+
+class Sequence:
+    """Persistent counter handing out increasing integers across workers.
+
+    The next value is kept in a tiny JSON file that is rewritten under its
+    own advisory lock, so allocating costs one small read and write however
+    many records exist, and a value is never handed out twice, even after
+    records are deleted. start is the first value, or a callable computing
+    it (e.g. from existing records) the first time the counter is used.
+    """
+
+    engine = "json"
+
+    def __init__(self, name, path, start=1):
+        self.name = name
+        self.path = path
+        self._start = start
+        self._file_lock = FileLock(path + ".lock")
+        self.allocated = 0
+
+    def _first(self):
+        return self._start() if callable(self._start) else self._start
+
+    def next(self):
+        """Allocate and return the next value."""
+        with self._file_lock:
+            try:
+                with open(self.path) as f:
+                    value = json.load(f)["next"]
+            except FileNotFoundError:
+                value = self._first()
+            atomic_write_json(self.path, {"next": value + 1})
+        self.allocated += 1
+        return value
+
+    def stats(self):
+        return {"name": self.name, "engine": self.engine, "allocated": self.allocated}
+
+
+class SqliteSequence(Sequence):
+    """Sequence kept as a row of the sequences table in SQLITE_PATH."""
+
+    engine = "sqlite"
+
+    def __init__(self, name, path, start=1, db_path=None):
+        super().__init__(name, path, start)
+        self.db_path = db_path or SQLITE_PATH
+
+    def _current(self, conn):
+        row = conn.execute("SELECT next FROM sequences WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else None
+
+    def next(self):
+        conn = sqlite_connection(self.db_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, next INTEGER NOT NULL)")
+        # Compute a callable start outside the write transaction; it may read other tables
+        first = self._first() if self._current(conn) is None else None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = self._current(conn)
+            if value is None:
+                value = first if first is not None else self._first()
+            conn.execute(
+                "INSERT INTO sequences (name, next) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET next = excluded.next",
+                (self.name, value + 1),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.allocated += 1
+        return value
+
+
+def open_sequence(name, path, start=1):
+    """Create the counter for name using the configured STORE_ENGINE."""
+    if STORE_ENGINE == "sqlite":
+        return SqliteSequence(name, path, start)
+    return Sequence(name, path, start)
+
+
+def open_store(name, path, key, indexes=None, default=None, durability=None):
+    """Create the store for a data file using the configured STORE_ENGINE."""
+    options = dict(indexes=indexes, default=default, durability=durability)
+    if STORE_ENGINE == "json":
+        store = JsonStore(name, path, key, **options)
+    elif STORE_ENGINE == "journal":
+        store = JournalStore(name, path, key, **options)
+    elif STORE_ENGINE == "sqlite":
+        store = SqliteStore(name, path, key, **options)
+    else:
+        raise ValueError(f"Unknown STORE_ENGINE: {STORE_ENGINE}")
+    _stores.append(store)
+    return store
+
+
+def writes_together(*stores):
+    """Whether upsert_together() commits to these stores in one transaction:
+    sqlite stores in one database, written synchronously."""
+    return (all(isinstance(store, SqliteStore) and store.durability != "group" for store in stores)
+            and len({store.db_path for store in stores}) == 1)
+
+
+def upsert_together(writes):
+    """Upsert each (store, records) pair of writes, in one transaction when
+    writes_together() holds for the stores and one store after another
+    otherwise. Callers hold the stores' lock() when they read before writing."""
+    writes = [(store, list(records)) for store, records in writes]
+    writes = [(store, records) for store, records in writes if records]
+    stores = [store for store, _ in writes]
+    if not writes_together(*stores):
+        for store, records in writes:
+            store.upsert_many(records)
+        return
+    writes = [(store, [(store.key_of(r), freeze(r)) for r in records]) for store, records in writes]
+    with ExitStack() as held:
+        for store in stores:
+            held.enter_context(store._file_lock)
+        for store in stores:
+            held.enter_context(store._lock)
+        conn = stores[0]._conn
+        for store in stores[1:]:
+            store._conn  # Creates any missing table before the transaction
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            results = [store._write_in(conn, changes) for store, changes in writes]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for (store, changes), (cache_current, version, _) in zip(writes, results):
+            store._written(changes, cache_current, version)
+
+
+def migrate_json_to_sqlite(stores=None, db_path=None, force=False):
+    """One-shot copy of every store's JSON file (plus journal) into SQLite.
+
+    Tables that already hold data are skipped unless force is set. Returns a
+    list of (store name, records copied or None when skipped).
+    """
+    results = []
+    for store in stores if stores is not None else _stores:
+        store.flush()
+        source = JournalStore(store.name, store.path, store.key, default=list, durability="sync")
+        target = SqliteStore(store.name, store.path, store.key, indexes=store.indexes,
+                             durability="sync", db_path=db_path)
+        if target._version(target._conn) is not None and not force:
+            results.append((store.name, None))
+            continue
+        records = source.snapshot()
+        target.save(records)
+        results.append((store.name, len(records)))
+    return results
+
+
+def cache_stats():
+    """Hit/miss counters for every store created in this process."""
+    return [s.stats() for s in _stores]
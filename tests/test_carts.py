@@ -0,0 +1,27 @@
+# tests/test_carts.py
+"""Carts shared between workers through the spill."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import carts  # noqa: E402
+from carts import CartStore  # noqa: E402
+
+
+def test_spill_is_shared_by_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(carts.group_writer, "schedule", lambda s: None)
+    first, second = CartStore(), CartStore()
+    assert first.spill and first.db_path == carts.CART_SPILL_PATH
+
+    version = first.add("u1", "Pad", 2.0, 3, part_id="P1")
+    first.flush()
+    assert second.items("u1", version) == [{"item_name": "Pad", "price": 2.0, "quantity": 3, "part_id": "P1"}]
+
+    # Checkout on the second worker takes the cart the first one filled
+    items, version = second.take("u1", version)
+    assert [item["quantity"] for item in items] == [3]
+    second.flush()
+    assert first.items("u1", version) == []
@@ -0,0 +1,75 @@
+# tests/test_checkout.py
+"""Checkout writes and the repair of interrupted checkouts."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from checkout import StockReservations, place_order, repair_checkouts  # noqa: E402
+from store import JsonStore, SqliteStore  # noqa: E402
+
+
+def open_stores(engine, tmp_path):
+    """Catalogue, orders, reservations and checkout log stores on one engine."""
+    specs = [("catalogue", "part_id", {}), ("orders", "order_id", {}),
+             ("reservations", ("owner", "part_id"), {"part_id": "part_id"}), ("checkouts", "order_id", {})]
+    if engine == "sqlite":
+        db_path = str(tmp_path / "data.db")
+        return [SqliteStore(name, str(tmp_path / f"{name}.json"), key=key, indexes=indexes, db_path=db_path)
+                for name, key, indexes in specs]
+    return [JsonStore(name, str(tmp_path / f"{name}.json"), key=key, indexes=indexes)
+            for name, key, indexes in specs]
+
+
+def checkout(stores, order_id="ORD1"):
+    catalogue, orders, reservations, log = stores
+    cart = [{"item_name": "Pad", "price": 1.0, "quantity": 2, "part_id": "P1"}]
+    return place_order(catalogue, orders, StockReservations(reservations, catalogue), "u1", cart,
+                       lambda: {"order_id": order_id, "items": cart}, log=log)
+
+
+@pytest.mark.parametrize("engine", ["json", "sqlite"])
+def test_failed_order_write_leaves_stock_and_log_untouched(engine, tmp_path, monkeypatch):
+    stores = open_stores(engine, tmp_path)
+    catalogue, orders, _, log = stores
+    catalogue.upsert({"part_id": "P1", "name": "Pad", "stock": 5})
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(orders, "_write_rows" if engine == "sqlite" else "_write_changes", fail)
+    with pytest.raises(OSError):
+        checkout(stores)
+    assert catalogue.get("P1")["stock"] == 5
+    assert not log.snapshot()
+
+
+def test_repair_puts_back_stock_of_an_interrupted_checkout(tmp_path, capsys):
+    catalogue, orders, _, log = open_stores("json", tmp_path)
+    catalogue.upsert_many([{"part_id": "P1", "name": "Pad", "stock": 3},
+                           {"part_id": "P2", "name": "Disc", "stock": 7},
+                           {"part_id": "P3", "name": "Shoe", "stock": 4}])
+    orders.upsert({"order_id": "ORD2"})
+    # ORD1 died after its stock write; ORD2 after its order write; P3 moved on since
+    log.upsert({"order_id": "ORD1", "stock": {"P1": [5, 3], "P2": [7, 6], "P3": [6, 5]}})
+    log.upsert({"order_id": "ORD2", "stock": {"P2": [8, 7]}})
+
+    assert repair_checkouts(catalogue, orders, log) == 1
+    assert [catalogue.get(p)["stock"] for p in ("P1", "P2", "P3")] == [5, 7, 4]
+    assert "P3" in capsys.readouterr().out
+    assert not log.snapshot()
+
+
+@pytest.mark.parametrize("engine", ["json", "sqlite"])
+def test_checkout_decrements_stock_and_clears_the_log(engine, tmp_path):
+    stores = open_stores(engine, tmp_path)
+    catalogue, orders, _, log = stores
+    catalogue.upsert({"part_id": "P1", "name": "Pad", "stock": 5})
+    checkout(stores)
+    assert catalogue.get("P1")["stock"] == 3
+    assert orders.get("ORD1")["items"][0]["quantity"] == 2
+    assert not log.snapshot()
+    assert repair_checkouts(catalogue, orders, log) == 0
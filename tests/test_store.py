@@ -0,0 +1,132 @@
+# tests/test_store.py
+"""Failure handling of group-commit stores and syncing between workers."""
+
+import errno
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import store  # noqa: E402
+from store import JsonStore, SqliteStore  # noqa: E402
+
+
+def fail_first_write(monkeypatch):
+    """Make the next atomic_write_json raise ENOSPC, as on a full disk."""
+    real = store.atomic_write_json
+    calls = []
+
+    def write(*args, **kwargs):
+        if not calls:
+            calls.append(args)
+            raise OSError(errno.ENOSPC, "No space left on device")
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(store, "atomic_write_json", write)
+    return calls
+
+
+def test_failed_group_flush_keeps_store_usable_and_retries(tmp_path, monkeypatch):
+    # Flush by hand, not from the background writer
+    monkeypatch.setattr(store.group_writer, "schedule", lambda s: None)
+    path = str(tmp_path / "things.json")
+    things = JsonStore("things", path, key="id", indexes={"colour": "colour"}, durability="group")
+    things.upsert({"id": 1, "colour": "red"})
+    things.flush()
+
+    things.upsert({"id": 2, "colour": "blue"})
+    calls = fail_first_write(monkeypatch)
+    with pytest.raises(OSError):
+        things.flush()
+    assert calls
+
+    # Reads still work and still see the unflushed write
+    assert things.get(2)["colour"] == "blue"
+    assert [t["id"] for t in things.find("colour", "blue")] == [2]
+    assert len(things.snapshot()) == 2
+    things.upsert({"id": 3, "colour": "red"})
+
+    # The retry writes everything that was queued
+    things.flush()
+    with open(path) as f:
+        assert sorted(r["id"] for r in json.load(f)) == [1, 2, 3]
+    assert not things.stats()["pending"]
+    reopened = JsonStore("things", path, key="id")
+    assert reopened.get(2) == {"id": 2, "colour": "blue"}
+
+
+def test_sqlite_reads_wait_for_a_group_flush_in_progress(tmp_path, monkeypatch):
+    monkeypatch.setattr(store.group_writer, "schedule", lambda s: None)
+    things = SqliteStore("things", str(tmp_path / "things.json"), key="id", durability="group",
+                         db_path=str(tmp_path / "things.db"))
+    things.upsert({"id": 1, "n": 1})
+    things.flush()
+    things.upsert({"id": 1, "n": 2})
+
+    # Read from another thread once the flush has taken the pending writes but not committed them
+    real = SqliteStore._flush_changes
+    readers, seen = [], []
+
+    def flush_changes(self, changes):
+        reader = threading.Thread(target=lambda: seen.append(self.get(1)["n"]))
+        readers.append(reader)
+        reader.start()
+        reader.join(0.2)
+        real(self, changes)
+
+    monkeypatch.setattr(SqliteStore, "_flush_changes", flush_changes)
+    things.flush()
+    readers[0].join()
+    assert seen == [2]
+
+
+class RecordingListener:
+    """Listener that counts full rebuilds and patches."""
+
+    def __init__(self):
+        self.resets = 0
+        self.applied = []
+
+    def reset(self, records):
+        self.resets += 1
+
+    def apply(self, old, new):
+        self.applied.append((old and old["id"], new and new["id"]))
+
+
+def open_worker_pair(engine, tmp_path):
+    """Two stores on the same data, as two gunicorn workers would have."""
+    path = str(tmp_path / "things.json")
+    if engine == "sqlite":
+        db_path = str(tmp_path / "things.db")
+        return [SqliteStore("things", path, key="id", db_path=db_path) for _ in range(2)]
+    return [JsonStore("things", path, key="id") for _ in range(2)]
+
+
+@pytest.mark.parametrize("engine", ["json", "sqlite"])
+def test_other_workers_writes_patch_listeners(engine, tmp_path):
+    writer, reader = open_worker_pair(engine, tmp_path)
+    writer.upsert_many([{"id": i, "n": 0} for i in range(10)])
+    listener = RecordingListener()
+    reader.add_listener(listener)
+    assert len(reader.snapshot()) == 10
+    assert listener.resets == 1
+
+    writer.upsert({"id": 3, "n": 1})
+    writer.delete(4)
+    writer.upsert({"id": 10, "n": 0})
+    assert reader.get(3)["n"] == 1
+    assert reader.get(4) is None
+    assert [t["id"] for t in reader.snapshot()] == [0, 1, 2, 3, 5, 6, 7, 8, 9, 10]
+    assert listener.resets == 1
+    assert sorted(listener.applied, key=str) == sorted([(3, 3), (4, None), (None, 10)], key=str)
+    assert reader.stats()["incremental_reloads"] == 1
+
+    # Rewriting most records rebuilds instead
+    writer.upsert_many([{"id": i, "n": 2} for i in range(11)])
+    assert {t["n"] for t in reader.snapshot()} == {2}
+    assert listener.resets == 2